@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 from datetime import date, timedelta
+from StringIO import StringIO
 
 from django.contrib.auth.models import User
 from django.core.cache import cache
-from django.test import TestCase
+from django.core import serializers
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
+from django.db import IntegrityError, connection, transaction
 from django import VERSION as DJANGO_VERSION
 from mock import patch
 
@@ -23,9 +27,21 @@ from yummy.models import (
     Ingredient,
     Photo,
     RecipePhoto,
+    RecipeRating,
     IngredientInRecipe,
     IngredientInRecipeGroup,
+    SubstituteIngredient,
 )
+from yummy.utils.cache import get_generation
+from yummy.utils.rating import order_by_rating
+from yummy.utils.substitutes import invalidate_substitute_graph
+from yummy.utils.tree import CATEGORY_TREE, get_category_tree
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
 
 try:
     import ella
@@ -186,6 +202,25 @@ class TestCategoryModel(TestCase):
 
         tools.assert_equal('jajky/mnam-mnam/mnam-mnam-2', cx.path)
 
+    def test_moved_subtree_paths_rewritten(self):
+        if IS_ELLA_INSTALLED:
+            raise SkipTest()
+        c01 = Category.objects.create(title="Jajky", slug="jajky")
+        c12 = Category.objects.create(parent=self.c1, title="Mňam mňam", slug="mnam-mnam-2")
+        c123 = Category.objects.create(parent=c12, title="Kůň", slug="kun")
+        other = Category.objects.create(parent=self.c0, title="Mňam mňam 3", slug="mnam-mnam-3")
+
+        self.c1.parent = c01
+        self.c1.save()
+
+        tools.assert_equal('jajky/mnam-mnam/mnam-mnam-2', Category.objects.get(pk=c12.pk).path)
+        tools.assert_equal('jajky/mnam-mnam/mnam-mnam-2/kun', Category.objects.get(pk=c123.pk).path)
+        tools.assert_equal('amen/mnam-mnam-3', Category.objects.get(pk=other.pk).path)
+        tools.assert_equal(
+            u"Jajky / Mňam mňam / Mňam mňam / Kůň",
+            Category.objects.get(pk=c123.pk).chained_title
+        )
+
     def test_category_level(self):
         tools.assert_equal(1, self.c0.level)
         tools.assert_equal(2, self.c1.level)
@@ -210,6 +245,23 @@ class TestCategoryModel(TestCase):
         tools.assert_false(self.c1.is_ancestor_of(self.c0))
         tools.assert_true(self.c0.is_ancestor_of(self.c1))
 
+    def test_is_ancestor_doesnt_walk_parents(self):
+        c2 = Category.objects.create(parent=self.c1, title=u"Kůň", slug="kun")
+        c3 = Category.objects.create(parent=c2, title=u"Kůň 2", slug="kun-2")
+        c3 = Category.objects.get(pk=c3.pk)
+
+        def check():
+            tools.assert_true(self.c0.is_ancestor_of(c3))
+            tools.assert_false(c3.is_ancestor_of(self.c0))
+            tools.assert_equal(4, c3.level)
+
+        self.assertNumQueries(0, check)
+
+    def test_is_ancestor_ignores_path_prefix_siblings(self):
+        c01 = Category.objects.create(title=u"Ámen 2", slug="amen-2")
+        c02 = Category.objects.create(parent=c01, title=u"Kůň", slug="kun")
+        tools.assert_false(self.c0.is_ancestor_of(c02))
+
     def test_unicode_returns_title(self):
         tools.assert_equal(u"Mňam mňam", "%s" % self.c1.__unicode__())
 
@@ -247,6 +299,131 @@ class TestCategoryModel(TestCase):
 
         tools.assert_equals(c2.get_root_ancestor(), c0)
 
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_tree_lookups_dont_hit_db_once_built(self):
+        cache.clear()
+        c2 = Category.objects.create(parent=self.c1, title=u"Kůň", slug="kun")
+        c2 = Category.objects.get(pk=c2.pk)
+        get_category_tree()
+
+        def lookups():
+            tools.assert_equal(u"Ámen / Mňam mňam / Kůň", c2.chained_title)
+            tools.assert_equal(self.c0, c2.get_root_ancestor())
+            tools.assert_equal([self.c1, c2], self.c0.get_descendants())
+            tools.assert_equal([c2], self.c1.get_children())
+            tools.assert_true(self.c0.is_ancestor_of(c2))
+            tools.assert_equal("", c2.photo_hierarchic)
+
+        self.assertNumQueries(0, lookups)
+
+    def test_tree_reflects_moved_category(self):
+        c01 = Category.objects.create(title="Jajky", slug="jajky")
+        self.c1.parent = c01
+        self.c1.save()
+
+        tree = get_category_tree()
+        tools.assert_equal([self.c0, c01], tree.roots())
+        tools.assert_equal([self.c1], tree.children(c01.pk))
+        tools.assert_equal(c01, tree.parent(self.c1.pk))
+        tools.assert_equal(self.c1, tree.get_by_path('jajky/mnam-mnam'))
+
+    def test_subtree_matches_descendants_only(self):
+        c2 = Category.objects.create(parent=self.c1, title=u"Kůň", slug="kun")
+        Category.objects.create(title=u"Ámen 2", slug="amen-2")
+
+        tools.assert_equals([self.c0, self.c1, c2], list(Category.objects.subtree(self.c0)))
+        tools.assert_equals([self.c1, c2], list(Category.objects.subtree(self.c1)))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestCategoryTreeInvalidation(TransactionTestCase):
+
+    def setUp(self):
+        super(TestCategoryTreeInvalidation, self).setUp()
+        cache.clear()
+
+    def test_tree_is_invalidated_after_commit(self):
+        generation = get_category_tree().generation
+        with transaction.atomic():
+            category = Category.objects.create(title='foo')
+            tools.assert_equals(generation, get_generation(CATEGORY_TREE))
+
+        tools.assert_not_equals(generation, get_generation(CATEGORY_TREE))
+        tools.assert_true(category.pk in get_category_tree())
+
+    def test_rolled_back_change_keeps_tree(self):
+        generation = get_category_tree().generation
+        try:
+            with transaction.atomic():
+                Category.objects.create(title='foo')
+                raise IntegrityError
+        except IntegrityError:
+            pass
+
+        tools.assert_equals(generation, get_generation(CATEGORY_TREE))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestCategoryRecipesCounts(TransactionTestCase):
+
+    def setUp(self):
+        super(TestCategoryRecipesCounts, self).setUp()
+        cache.clear()
+        self.user = User.objects.create_user(username='foo')
+        self.cat = Category.objects.create(title="generic cat")
+        self.subcat = Category.objects.create(parent=self.cat, title="sub cat")
+        self.other = Category.objects.create(title="generic cat 2", slug="generic-cat-2")
+
+    def test_counts_follow_recipe_changes(self):
+        recipe = create_recipe(owner=self.user, category=self.subcat, slug='r1')
+        tools.assert_equals({self.cat.pk: 1, self.subcat.pk: 1, self.other.pk: 0}, Category.objects.get_recipes_counts())
+
+        recipe.category = self.other
+        recipe.save()
+        # no recount, counters were updated
+        with self.assertNumQueries(0):
+            tools.assert_equals({self.cat.pk: 0, self.subcat.pk: 0, self.other.pk: 1}, Category.objects.get_recipes_counts())
+
+        recipe.is_public = False
+        recipe.save()
+        with self.assertNumQueries(0):
+            tools.assert_equals({self.cat.pk: 0, self.subcat.pk: 0, self.other.pk: 0}, Category.objects.get_recipes_counts())
+
+        create_recipe(owner=self.user, category=self.subcat, slug='r2').delete()
+        tools.assert_equals({self.cat.pk: 0, self.subcat.pk: 0, self.other.pk: 0}, Category.objects.get_recipes_counts())
+
+    def test_rolled_back_change_keeps_counts(self):
+        create_recipe(owner=self.user, category=self.cat, slug='r1')
+        Category.objects.get_recipes_counts()
+
+        try:
+            with transaction.atomic():
+                create_recipe(owner=self.user, category=self.cat, slug='r2')
+                create_recipe(owner=self.user, category=self.cat, slug='r3')
+                raise IntegrityError
+        except IntegrityError:
+            pass
+
+        tools.assert_equals(1, self.cat.get_recipes_count())
+
+    def test_same_deltas_are_all_applied(self):
+        Category.objects.get_recipes_counts()
+        with transaction.atomic():
+            create_recipe(owner=self.user, category=self.cat, slug='r1')
+            create_recipe(owner=self.user, category=self.cat, slug='r2')
+
+        tools.assert_equals(2, self.cat.get_recipes_count())
+
+    def test_single_count_reads_own_counter(self):
+        create_recipe(owner=self.user, category=self.subcat, slug='r1')
+        Category.objects.get_recipes_counts()
+
+        with self.assertNumQueries(0):
+            tools.assert_equals(1, self.cat.get_recipes_count())
+        with patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            tools.assert_equals(0, self.other.get_recipes_count())
+        tools.assert_equals(2, len(get_many.call_args[0][0]))
+
 
 class TestRecipeModel(TestCase):
 
@@ -269,6 +446,63 @@ class TestRecipeModel(TestCase):
         tools.assert_equals([recipe], list(Recipe.objects.approved()))
         tools.assert_equals([recipe], list(Recipe.objects.all()))
 
+    def test_objects_in_category_includes_subcategories(self):
+        subcat = Category.objects.create(parent=self.cat, title="sub cat")
+        other = Category.objects.create(title="generic cat 2", slug="generic-cat-2")
+
+        r1 = create_recipe(owner=self.user, category=self.cat, slug='r1')
+        r2 = create_recipe(owner=self.user, category=subcat, slug='r2')
+        create_recipe(owner=self.user, category=other, slug='r3')
+
+        tools.assert_equals(set([r1, r2]), set(Recipe.objects.in_category(self.cat)))
+        tools.assert_equals([r2], list(Recipe.objects.in_category(subcat)))
+
+    def test_objects_in_big_category_filtered_by_path(self):
+        subcat = Category.objects.create(parent=self.cat, title="sub cat")
+        r1 = create_recipe(owner=self.user, category=self.cat, slug='r1')
+        r2 = create_recipe(owner=self.user, category=subcat, slug='r2')
+
+        with patch.object(conf, 'CATEGORY_SUBTREE_IDS_MAX', 1):
+            qs = Recipe.objects.in_category(self.cat)
+            tools.assert_true('LIKE' in str(qs.query))
+            tools.assert_equals(set([r1, r2]), set(qs))
+            tools.assert_false('LIKE' in str(Recipe.objects.in_category(subcat).query))
+
+    def test_categories_recipes_counts_roll_up(self):
+        subcat = Category.objects.create(parent=self.cat, title="sub cat")
+        other = Category.objects.create(title="generic cat 2", slug="generic-cat-2")
+
+        create_recipe(owner=self.user, category=self.cat, slug='r1')
+        create_recipe(owner=self.user, category=subcat, slug='r2')
+        create_recipe(owner=self.user, category=subcat, slug='r3', is_public=False)
+        create_recipe(owner=self.user, category=subcat, slug='r4', is_approved=False)
+
+        tools.assert_equals({self.cat.pk: 2, subcat.pk: 1, other.pk: 0}, Category.objects.get_recipes_counts())
+        tools.assert_equals(2, self.cat.get_recipes_count())
+        tools.assert_equals(0, other.get_recipes_count())
+
+    def test_attach_groupped_ingredients_loads_recipes_at_once(self):
+        i1 = Ingredient.objects.create(name='foobar')
+        i2 = Ingredient.objects.create(name='foobar2')
+        r1 = create_recipe(owner=self.user, category=self.cat, slug='r1')
+        r2 = create_recipe(owner=self.user, category=self.cat, slug='r2')
+        group = IngredientInRecipeGroup.objects.create(recipe=r1, title='dough')
+        IngredientInRecipe.objects.create(recipe=r1, ingredient=i1)
+        IngredientInRecipe.objects.create(recipe=r1, ingredient=i2, group=group)
+        IngredientInRecipe.objects.create(recipe=r2, ingredient=i2)
+
+        recipes = [Recipe.objects.get(pk=r1.pk), Recipe.objects.get(pk=r2.pk)]
+        self.assertNumQueries(1, lambda: Recipe.objects.attach_groupped_ingredients(recipes))
+
+        with self.assertNumQueries(0):
+            groups = recipes[0].groupped_ingredients()
+        tools.assert_equals(['__nogroup__', 'dough'], [title for title, group in groups])
+        tools.assert_equals(
+            [[i1], [i2]],
+            [[one.ingredient for one in group['items']] for title, group in groups]
+        )
+        tools.assert_equals(recipes[1].groupped_ingredients(recache=True), recipes[1].groupped_ingredients())
+
     def test_unicode_pass(self):
         #coverage ftw!
         title = u'sytý nášup'
@@ -284,8 +518,92 @@ class TestRecipeModel(TestCase):
         RecipePhoto.objects.create(pk=100, recipe=recipe, photo=photo_1, is_visible=True)
         RecipePhoto.objects.create(pk=200, recipe=recipe, photo=photo_2, is_visible=True)
 
+        recipe = Recipe.objects.get(pk=recipe.pk)
         tools.assert_equals(photo_2.pk, recipe.get_top_photo().pk)
 
+    def test_attach_top_photos_resolves_recipes_at_once(self):
+        other_user = User.objects.create_user(username='bar')
+        r1 = create_recipe(owner=self.user, category=self.cat, slug='r1')
+        r2 = create_recipe(owner=self.user, category=self.cat, slug='r2')
+
+        photo_1 = Photo.objects.create(width=1, height=1, owner=other_user)
+        photo_2 = Photo.objects.create(width=1, height=1, owner=self.user)
+        photo_3 = Photo.objects.create(width=1, height=1, owner=self.user)
+        RecipePhoto.objects.create(recipe=r1, photo=photo_1)
+        RecipePhoto.objects.create(recipe=r1, photo=photo_2)
+        RecipePhoto.objects.create(recipe=r2, photo=photo_3, is_visible=False)
+
+        recipes = list(Recipe.objects.filter(pk__in=(r1.pk, r2.pk)).order_by('pk'))
+        self.assertNumQueries(1, lambda: Recipe.objects.attach_top_photos(recipes))
+
+        tools.assert_equals(photo_2, recipes[0].top_photo)
+        tools.assert_equals("", recipes[1].top_photo)
+
+        recipes = list(Recipe.objects.filter(pk__in=(r1.pk, r2.pk)).select_related('main_photo', 'category').order_by('pk'))
+        self.assertNumQueries(0, lambda: Recipe.objects.attach_top_photos(recipes))
+        tools.assert_equals(photo_2, recipes[0].top_photo)
+
+    def test_cards_render_by_single_query(self):
+        photo = Photo.objects.create(width=1, height=1, owner=self.user)
+        r1 = create_recipe(owner=self.user, category=self.cat, slug='r1')
+        create_recipe(owner=self.user, category=self.cat, slug='r2')
+        RecipePhoto.objects.create(recipe=r1, photo=photo)
+
+        def render():
+            recipes = Recipe.objects.attach_top_photos(list(Recipe.objects.public().cards().order_by('pk')))
+            return [(one.get_absolute_url(), one.title, one.owner.username, one.top_photo) for one in recipes]
+
+        with self.assertNumQueries(1):
+            cards = render()
+
+        tools.assert_equals(photo, cards[0][3])
+        tools.assert_equals("", cards[1][3])
+        tools.assert_true('preparation' in Recipe.objects.cards()[0].get_deferred_fields())
+
+    def test_main_photo_follows_photos_changes(self):
+        recipe = create_recipe(owner=self.user, category=self.cat)
+        photo_1 = Photo.objects.create(width=1, height=1, owner=self.user)
+        photo_2 = Photo.objects.create(width=1, height=1, owner=self.user)
+
+        rp1 = RecipePhoto.objects.create(recipe=recipe, photo=photo_1)
+        tools.assert_equals(photo_1.pk, Recipe.objects.get(pk=recipe.pk).main_photo_id)
+
+        rp2 = RecipePhoto.objects.create(recipe=recipe, photo=photo_2)
+        tools.assert_equals(photo_2.pk, Recipe.objects.get(pk=recipe.pk).main_photo_id)
+
+        rp2.is_visible = False
+        rp2.save()
+        tools.assert_equals(photo_1.pk, Recipe.objects.get(pk=recipe.pk).main_photo_id)
+
+        tools.assert_true(Recipe.objects.get(pk=recipe.pk).has_photo)
+
+        rp1.delete()
+        tools.assert_equals(None, Recipe.objects.get(pk=recipe.pk).main_photo_id)
+        tools.assert_false(Recipe.objects.get(pk=recipe.pk).has_photo)
+
+    def test_save_keeps_main_photo_of_stale_instance(self):
+        recipe = create_recipe(owner=self.user, category=self.cat)
+        loaded = Recipe.objects.get(pk=recipe.pk)
+        photo = Photo.objects.create(width=1, height=1, owner=self.user)
+        RecipePhoto.objects.create(recipe=recipe, photo=photo)
+
+        loaded.title = 'renamed'
+        loaded.save()
+
+        tools.assert_equals(('renamed', photo.pk, True),
+                            Recipe.objects.filter(pk=recipe.pk).values_list('title', 'main_photo', 'has_photo')[0])
+
+    def test_update_photos_command_backfills_main_photo(self):
+        recipe = create_recipe(owner=self.user, category=self.cat)
+        photo = Photo.objects.create(width=1, height=1, owner=self.user)
+        RecipePhoto.objects.create(recipe=recipe, photo=photo)
+        Recipe.objects.update(main_photo=None, has_photo=False)
+
+        call_command('yummy_update_photos', stdout=StringIO())
+
+        tools.assert_equals(photo.pk, Recipe.objects.get(pk=recipe.pk).main_photo_id)
+        tools.assert_true(Recipe.objects.get(pk=recipe.pk).has_photo)
+
     def test_get_top_photo_fallback(self):
 
         recipe = create_recipe(owner=self.user, category=self.cat)
@@ -450,3 +768,202 @@ class TestIngredientInRecipeGroup(TestCase):
 
         tools.assert_equals(ir1.order, 1)
         tools.assert_equals(ir2.order, 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestIngredientRecipesIndex(TransactionTestCase):
+
+    def setUp(self):
+        super(TestIngredientRecipesIndex, self).setUp()
+        cache.clear()
+        self.user = User.objects.create(username='user')
+        self.cat = Category.objects.create(title='foo', path='foo')
+        self.salt = Ingredient.objects.create(name='salt', slug='salt')
+        self.pepper = Ingredient.objects.create(name='pepper', slug='pepper')
+        self.r1 = create_recipe(owner=self.user, category=self.cat, slug='r1')
+        self.r2 = create_recipe(owner=self.user, category=self.cat, slug='r2')
+        for recipe in (self.r1, self.r2):
+            IngredientInRecipe.objects.create(recipe=recipe, ingredient=self.salt)
+
+    def test_public_recipes_newest_first(self):
+        create_recipe(owner=self.user, category=self.cat, slug='r3', is_public=False)
+        tools.assert_equals([self.r2.pk, self.r1.pk], Ingredient.objects.get_recipe_ids(self.salt.pk))
+
+        with self.assertNumQueries(0):
+            counts = Ingredient.objects.get_recipes_counts([self.salt.pk])
+        tools.assert_equals({self.salt.pk: 2}, counts)
+
+    def test_index_follows_ingredients_changes(self):
+        Ingredient.objects.get_recipes_counts([self.salt.pk, self.pepper.pk])
+
+        item = IngredientInRecipe.objects.get(recipe=self.r1)
+        item.ingredient = self.pepper
+        item.save()
+
+        tools.assert_equals({self.salt.pk: 1, self.pepper.pk: 1},
+                            Ingredient.objects.get_recipes_counts([self.salt.pk, self.pepper.pk]))
+
+    def test_index_follows_recipe_visibility(self):
+        Ingredient.objects.get_recipe_ids(self.salt.pk)
+
+        self.r1.is_public = False
+        self.r1.save()
+
+        tools.assert_equals([self.r2.pk], Ingredient.objects.get_recipe_ids(self.salt.pk))
+
+    def test_changes_drop_index_to_be_rebuilt_lazily(self):
+        Ingredient.objects.get_recipe_ids(self.salt.pk)
+
+        with transaction.atomic():
+            IngredientInRecipe.objects.create(recipe=self.r1, ingredient=self.salt)
+            IngredientInRecipe.objects.create(recipe=self.r2, ingredient=self.salt)
+        tools.assert_equals(None, cache.get(Ingredient.objects._recipe_index_key(self.salt.pk)))
+
+        tools.assert_equals([self.r2.pk, self.r1.pk], Ingredient.objects.get_recipe_ids(self.salt.pk))
+
+    def test_index_keeps_newest_ids_and_full_count(self):
+        r3 = create_recipe(owner=self.user, category=self.cat, slug='r3')
+        IngredientInRecipe.objects.create(recipe=r3, ingredient=self.salt)
+
+        with patch.object(conf, 'INGREDIENT_RECIPE_IDS_MAX', 2):
+            tools.assert_equals((3, [r3.pk, self.r2.pk]), Ingredient.objects.get_recipe_index(self.salt.pk))
+        tools.assert_equals({self.salt.pk: 3}, Ingredient.objects.get_recipes_counts([self.salt.pk]))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestSubstituteIngredients(TestCase):
+
+    def setUp(self):
+        super(TestSubstituteIngredients, self).setUp()
+        cache.clear()
+        self.butter = Ingredient.objects.create(name='butter', slug='butter')
+        self.margarine = Ingredient.objects.create(name='margarine', slug='margarine')
+        self.salt = Ingredient.objects.create(name='salt', slug='salt')
+        self.sub = SubstituteIngredient.objects.create(ingredient=self.butter, substitute=self.margarine)
+
+    def test_attach_to_ingredients_loads_substitutes_at_once(self):
+        ingredients = [Ingredient.objects.get(pk=self.butter.pk), Ingredient.objects.get(pk=self.salt.pk)]
+        self.assertNumQueries(1, lambda: SubstituteIngredient.objects.attach_to_ingredients(ingredients))
+
+        with self.assertNumQueries(0):
+            tools.assert_equals([[self.margarine], []], [[one.substitute for one in i.substitutes] for i in ingredients])
+
+    def test_alternatives_include_substitutes_of_substitutes(self):
+        SubstituteIngredient.objects.create(ingredient=self.margarine, substitute=self.salt)
+        invalidate_substitute_graph()
+
+        tools.assert_equals([(self.margarine, 1), (self.salt, 2)], Ingredient.objects.get_alternatives(self.butter.pk))
+        tools.assert_equals([(self.margarine, 1)], Ingredient.objects.get_alternatives(self.butter.pk, depth=1))
+
+    def test_bulk_and_single_lookup_share_cache(self):
+        SubstituteIngredient.objects.get_for_ingredients_cached([self.butter, self.salt])
+
+        with self.assertNumQueries(0):
+            tools.assert_equals([self.sub], SubstituteIngredient.objects.get_for_ingredient_cached(self.butter))
+            tools.assert_equals([], SubstituteIngredient.objects.get_for_ingredient_cached(self.salt))
+
+
+class TestRecipeRating(TestCase):
+
+    def setUp(self):
+        super(TestRecipeRating, self).setUp()
+        self.user = User.objects.create(username='user')
+        self.cat = Category.objects.create(title='foo', path='foo')
+        self.recipe = create_recipe(owner=self.user, category=self.cat)
+
+    def test_rating_is_created_with_recipe(self):
+        rating = RecipeRating.objects.get(recipe=self.recipe)
+        tools.assert_equals(0, rating.votes_count)
+        tools.assert_almost_equals(conf.RATING_PRIOR_MEAN, rating.score)
+
+    def test_rating_is_created_with_fixture_recipe(self):
+        data = serializers.serialize('json', [self.recipe])
+        RecipeRating.objects.all().delete()
+        Recipe.objects.all().delete()
+
+        for one in serializers.deserialize('json', data):
+            one.save()
+
+        tools.assert_true(RecipeRating.objects.filter(recipe=self.recipe.pk).exists())
+
+    def test_votes_update_bayesian_score(self):
+        RecipeRating.objects.add_vote(self.recipe.pk, 5)
+        RecipeRating.objects.add_vote(self.recipe.pk, 4)
+
+        rating = RecipeRating.objects.get(recipe=self.recipe)
+        tools.assert_equals((2, 9), (rating.votes_count, rating.votes_sum))
+        tools.assert_almost_equals(RecipeRating.objects.compute_score(2, 9), rating.score)
+        tools.assert_almost_equals((conf.RATING_PRIOR_VOTES * conf.RATING_PRIOR_MEAN + 9.) / (conf.RATING_PRIOR_VOTES + 2), rating.score)
+
+    def test_order_by_rating(self):
+        other = create_recipe(owner=self.user, category=self.cat, slug='other')
+        RecipeRating.objects.set_votes(other.pk, 10, 50)
+        RecipeRating.objects.set_votes(self.recipe.pk, 1, 5)
+
+        tools.assert_equals([other, self.recipe], list(order_by_rating(Recipe.objects.all())))
+
+    def test_refresh_command_creates_missing_ratings(self):
+        RecipeRating.objects.all().delete()
+        RecipeRating.objects.create(recipe=self.recipe, votes_count=1, votes_sum=5)
+        other = create_recipe(owner=self.user, category=self.cat, slug='other')
+        RecipeRating.objects.filter(pk=other.pk).delete()
+        RecipeRating.objects.update(score=0)
+
+        call_command('yummy_refresh_ratings', stdout=StringIO())
+
+        tools.assert_almost_equals(RecipeRating.objects.compute_score(1, 5), RecipeRating.objects.get(pk=self.recipe.pk).score)
+        tools.assert_almost_equals(conf.RATING_PRIOR_MEAN, RecipeRating.objects.get(pk=other.pk).score)
+
+
+class TestRecipeListingIndexes(TestCase):
+
+    def setUp(self):
+        super(TestRecipeListingIndexes, self).setUp()
+        if connection.vendor != 'sqlite':
+            raise SkipTest("query plans are checked on sqlite only")
+        self.user = User.objects.create(username='user')
+        self.cat = Category.objects.create(title='foo', path='foo')
+
+    def get_index(self, *columns):
+        cursor = connection.cursor()
+        try:
+            constraints = connection.introspection.get_constraints(cursor, Recipe._meta.db_table)
+        finally:
+            cursor.close()
+        for name, info in constraints.items():
+            if info['index'] and tuple(info['columns']) == columns:
+                return name
+
+    def get_plan(self, qs):
+        sql, params = qs.query.sql_with_params()
+        cursor = connection.cursor()
+        try:
+            cursor.execute('EXPLAIN QUERY PLAN %s' % sql, params)
+            return ' '.join(row[-1] for row in cursor.fetchall())
+        finally:
+            cursor.close()
+
+    def assert_uses_index(self, qs, *columns):
+        index = self.get_index(*columns)
+        tools.assert_true(index)
+        tools.assert_in(index, self.get_plan(qs))
+
+    def test_public_listings_by_date(self):
+        self.assert_uses_index(Recipe.objects.public().cards().order_by('-created')[:15],
+                               'is_approved', 'is_public', 'created')
+
+    def test_public_listings_by_title(self):
+        self.assert_uses_index(Recipe.objects.public().cards().order_by('title')[:15],
+                               'is_approved', 'is_public', 'title')
+
+    def test_category_listing(self):
+        self.assert_uses_index(Recipe.objects.public().cards().in_category(self.cat).order_by('-created')[:15],
+                               'category_id', 'is_approved', 'is_public', 'created')
+
+    def test_author_listing(self):
+        self.assert_uses_index(Recipe.objects.public().cards().filter(owner=self.user).order_by('-created')[:15],
+                               'owner_id', 'is_approved', 'is_public', 'created')
+
+    def test_photo_listing(self):
+        self.assert_uses_index(Recipe.objects.public().cards().filter(has_photo=True).order_by('-created')[:15],
+                               'has_photo', 'is_approved', 'is_public', 'created')
@@ -5,7 +5,7 @@ from django.test import TestCase
 
 from mock import patch
 
-from yummy.models import WeekMenu
+from yummy.models import WeekMenu, Category
 from yummy.templatetags.yummy_tags import yummy_day_menu
 
 from nose import tools
@@ -66,3 +66,16 @@ class TestTags(TestCase):
         t.render(c)
 
         tools.assert_equals(c['recommends'], tuple())
+
+    def test_get_categories_returns_roots_and_children(self):
+        c0 = Category.objects.create(title='foo')
+        c1 = Category.objects.create(parent=c0, title='bar')
+        Category.objects.create(parent=c1, title='baz')
+
+        c = Context({'category': c0})
+        t = Template("{% load yummy_tags %}{% yummy_get_categories as roots %}"
+                     "{% yummy_get_categories from category as children %}")
+        t.render(c)
+
+        tools.assert_equals(c['roots'], [c0])
+        tools.assert_equals(c['children'], [c1])
@@ -0,0 +1,409 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from mock import patch
+from nose import tools
+
+from yummy.models import Category, Recipe, Ingredient, IngredientInRecipe, SubstituteIngredient, UnitConversion
+from yummy.utils.autocomplete import IngredientIndex, fold
+from yummy.utils.cache import INGREDIENTS, get_generation
+from yummy.utils import matching
+from yummy.utils.matching import IngredientMatcher, Match
+from yummy.utils.substitutes import SubstituteGraph
+from yummy.utils.units import ConversionMatrix, convert_amounts
+from yummy.utils.pagination import (
+    InvalidCursor, CountedPaginator, get_listing_count, invalidate_listing_counts, paginate_keyset
+)
+from yummy.utils.recache import recache_task, schedule
+
+from tests.test_models import LOCMEM_CACHES
+
+calls = []
+
+
+@recache_task
+def _record_call(*args):
+    calls.append(args)
+
+
+class TestRecache(TransactionTestCase):
+
+    def setUp(self):
+        super(TestRecache, self).setUp()
+        del calls[:]
+
+    def test_rebuild_runs_right_away_outside_transaction(self):
+        schedule('_record_call', 1)
+        schedule('_record_call', 1)
+
+        tools.assert_equals([(1,), (1,)], calls)
+
+    def test_rebuilds_are_coalesced_until_commit(self):
+        with transaction.atomic():
+            schedule('_record_call', 1)
+            schedule('_record_call', 2)
+            schedule('_record_call', 1)
+            tools.assert_equals([], calls)
+
+        tools.assert_equals([(1,), (2,)], calls)
+
+    def test_rolled_back_rebuilds_are_dropped(self):
+        try:
+            with transaction.atomic():
+                schedule('_record_call', 1)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        tools.assert_equals([], calls)
+
+        with transaction.atomic():
+            schedule('_record_call', 1)
+        tools.assert_equals([(1,)], calls)
+
+
+class TestKeysetPagination(TestCase):
+
+    def setUp(self):
+        super(TestKeysetPagination, self).setUp()
+        user = User.objects.create(username='user')
+        cat = Category.objects.create(title='foo', path='foo')
+        self.recipes = [
+            Recipe.objects.create(title='r%d' % i, category=cat, owner=user, preparation_time=10)
+            for i in range(5)
+        ]
+        # two recipes share creation time, id has to break the tie
+        created = now()
+        for i, recipe in enumerate(self.recipes):
+            recipe.created = created - timedelta(minutes=min(i, 3))
+            Recipe.objects.filter(pk=recipe.pk).update(created=recipe.created)
+
+    def walk(self, order_attr):
+        pages = []
+        page = paginate_keyset(Recipe.objects.all(), order_attr, 2)
+        pages.append(page)
+        while page.has_next():
+            page = paginate_keyset(Recipe.objects.all(), order_attr, 2, page.next_cursor)
+            pages.append(page)
+        return pages
+
+    def test_walk_forward_by_date(self):
+        pages = self.walk('-created')
+
+        tools.assert_equals([2, 2, 1], [len(one) for one in pages])
+        # descending by id within the same time
+        r0, r1, r2, r3, r4 = self.recipes
+        tools.assert_equals([r0, r1, r2, r4, r3], [one for page in pages for one in page])
+        tools.assert_false(pages[0].has_previous())
+        tools.assert_true(pages[1].has_previous())
+
+    def test_walk_back_by_title(self):
+        pages = self.walk('title')
+        page = paginate_keyset(Recipe.objects.all(), 'title', 2, pages[-1].previous_cursor)
+
+        tools.assert_equals(self.recipes[2:4], page.object_list)
+        tools.assert_true(page.has_next())
+        tools.assert_true(page.has_previous())
+
+        page = paginate_keyset(Recipe.objects.all(), 'title', 2, page.previous_cursor)
+        tools.assert_equals(self.recipes[:2], page.object_list)
+        tools.assert_false(page.has_previous())
+
+    def test_seek_costs_single_query(self):
+        cursor = self.walk('-created')[1].next_cursor
+        with self.assertNumQueries(1):
+            paginate_keyset(Recipe.objects.all(), '-created', 2, cursor)
+
+    def test_invalid_cursor(self):
+        tools.assert_raises(InvalidCursor, paginate_keyset, Recipe.objects.all(), '-created', 2, 'foo')
+        tools.assert_raises(InvalidCursor, paginate_keyset, Recipe.objects.all(), '-created', 2, 'WyJmb28iLDEsIm4iXQ')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestListingCounts(TransactionTestCase):
+
+    def setUp(self):
+        super(TestListingCounts, self).setUp()
+        cache.clear()
+        self.user = User.objects.create(username='user')
+        self.cat = Category.objects.create(title='foo', path='foo')
+
+    def create_recipe(self):
+        return Recipe.objects.create(title='foo', category=self.cat, owner=self.user, preparation_time=10, is_approved=True)
+
+    def test_count_is_cached_per_listing(self):
+        self.create_recipe()
+        tools.assert_equals(1, get_listing_count(Recipe.objects.public(), ('foo',)))
+
+        with self.assertNumQueries(0):
+            tools.assert_equals(1, get_listing_count(Recipe.objects.public(), ('foo',)))
+        tools.assert_equals(0, get_listing_count(Recipe.objects.filter(owner=None), ('foo', 'bar')))
+
+        invalidate_listing_counts()
+        with self.assertNumQueries(1):
+            get_listing_count(Recipe.objects.public(), ('foo',))
+
+    def test_recipe_changes_invalidate_counts(self):
+        get_listing_count(Recipe.objects.public(), ('foo',))
+        self.create_recipe()
+
+        tools.assert_equals(1, get_listing_count(Recipe.objects.public(), ('foo',)))
+
+    def test_moved_subtree_invalidates_counts(self):
+        other = Category.objects.create(title='bar', path='bar')
+        Recipe.objects.create(title='bar', category=other, owner=self.user, preparation_time=10, is_approved=True)
+        url = reverse('yummy:category_detail', args=(self.cat.path,))
+        tools.assert_equals(0, self.client.get(url).context['paginator'].count)
+
+        other.parent = self.cat
+        other.save()
+
+        tools.assert_equals(1, self.client.get(url).context['paginator'].count)
+
+    def test_paginator_takes_count_from_function(self):
+        paginator = CountedPaginator(Recipe.objects.all(), 10, count_func=lambda: 42)
+        with self.assertNumQueries(0):
+            tools.assert_equals(5, paginator.num_pages)
+
+
+class TestIngredientMatcher(SimpleTestCase):
+
+    def setUp(self):
+        self.matcher = IngredientMatcher()
+        self.matcher.set_recipe(1, [10, 11])
+        self.matcher.set_recipe(2, [10, 11, 12])
+        self.matcher.set_recipe(3, [12, 13])
+
+    def test_recipes_missing_less_go_first(self):
+        tools.assert_equals([Match(1, 2, 0), Match(2, 2, 1)], self.matcher.match([10, 11]))
+
+    def test_min_matched_and_max_missing(self):
+        tools.assert_equals([Match(2, 2, 1)], self.matcher.match([11, 12], min_matched=2))
+        tools.assert_equals([Match(1, 1, 1)], self.matcher.match([11], max_missing=1))
+
+    def test_substitutes_count_as_matched(self):
+        self.matcher.set_substitutes([(13, 14)])
+        tools.assert_equals([], self.matcher.match([12, 14], min_matched=2))
+        tools.assert_equals([Match(3, 2, 0)], self.matcher.match([12, 14], min_matched=2, substitutes=True))
+
+    def test_set_recipe_replaces_ingredients(self):
+        self.matcher.set_recipe(1, [13])
+        self.matcher.set_recipe(3, [])
+
+        tools.assert_equals([Match(1, 1, 0)], self.matcher.match([13]))
+        tools.assert_equals(2, len(self.matcher))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestRecipeMatching(TransactionTestCase):
+
+    def setUp(self):
+        super(TestRecipeMatching, self).setUp()
+        cache.clear()
+        self.user = User.objects.create(username='user')
+        self.cat = Category.objects.create(title='foo', path='foo')
+        self.salt = Ingredient.objects.create(name='salt', slug='salt')
+        self.pepper = Ingredient.objects.create(name='pepper', slug='pepper')
+        self.recipe = Recipe.objects.create(title='foo', category=self.cat, preparation_time=10,
+                                            owner=self.user, is_approved=True)
+        IngredientInRecipe.objects.create(recipe=self.recipe, ingredient=self.salt)
+
+    def test_matcher_follows_recipe_changes(self):
+        tools.assert_equals([Match(self.recipe.pk, 1, 0)], Recipe.objects.match_ingredients([self.salt.pk]))
+
+        IngredientInRecipe.objects.create(recipe=self.recipe, ingredient=self.pepper)
+        tools.assert_equals([Match(self.recipe.pk, 1, 1)], Recipe.objects.match_ingredients([self.salt.pk]))
+
+        self.recipe.is_public = False
+        self.recipe.save()
+        tools.assert_equals([], Recipe.objects.match_ingredients([self.salt.pk]))
+
+    def test_matcher_follows_substitutes(self):
+        tools.assert_equals([], Recipe.objects.match_ingredients([self.pepper.pk], substitutes=True))
+
+        SubstituteIngredient.objects.create(ingredient=self.salt, substitute=self.pepper)
+        tools.assert_equals([Match(self.recipe.pk, 1, 0)],
+                            Recipe.objects.match_ingredients([self.pepper.pk], substitutes=True))
+
+        # substitute of substitute
+        sugar = Ingredient.objects.create(name='sugar', slug='sugar')
+        SubstituteIngredient.objects.create(ingredient=self.pepper, substitute=sugar)
+        tools.assert_equals([Match(self.recipe.pk, 1, 0)],
+                            Recipe.objects.match_ingredients([sugar.pk], substitutes=True))
+
+    def test_matching_holds_lock(self):
+        locked = []
+
+        def match(matcher, *args):
+            locked.append(matching._lock.locked())
+            return []
+
+        with patch.object(IngredientMatcher, 'match', match):
+            Recipe.objects.match_ingredients([self.salt.pk])
+        tools.assert_equals([True], locked)
+
+
+class TestRecipeMatchingWithoutCache(TestCase):
+
+    def setUp(self):
+        super(TestRecipeMatchingWithoutCache, self).setUp()
+        self.user = User.objects.create(username='user')
+        self.cat = Category.objects.create(title='foo', path='foo')
+        self.salt = Ingredient.objects.create(name='salt', slug='salt')
+        self.pepper = Ingredient.objects.create(name='pepper', slug='pepper')
+        self.recipe = Recipe.objects.create(title='foo', category=self.cat, preparation_time=10,
+                                            owner=self.user, is_approved=True)
+        self.other = Recipe.objects.create(title='bar', category=self.cat, preparation_time=10,
+                                           owner=self.user, is_approved=True)
+        IngredientInRecipe.objects.create(recipe=self.recipe, ingredient=self.salt)
+        IngredientInRecipe.objects.create(recipe=self.other, ingredient=self.pepper)
+
+    def test_only_recipes_of_requested_ingredients_are_loaded(self):
+        with patch.object(IngredientMatcher, 'set_recipe') as set_recipe:
+            Recipe.objects.match_ingredients([self.salt.pk])
+        tools.assert_equals([self.recipe.pk], [one[0][0] for one in set_recipe.call_args_list])
+
+    def test_matches_current_data(self):
+        tools.assert_equals([Match(self.recipe.pk, 1, 0)], Recipe.objects.match_ingredients([self.salt.pk]))
+
+        # no log of changes is kept without cache
+        IngredientInRecipe.objects.create(recipe=self.recipe, ingredient=self.pepper)
+        tools.assert_equals([Match(self.recipe.pk, 1, 1)], Recipe.objects.match_ingredients([self.salt.pk]))
+
+
+class TestSubstituteGraph(SimpleTestCase):
+
+    def setUp(self):
+        # 2 replaces 1, 3 replaces 2 and 1, 4 replaces 3
+        self.graph = SubstituteGraph([(1, 2), (2, 3), (1, 3), (3, 4)], max_depth=2)
+
+    def test_substitutes_nearest_first(self):
+        tools.assert_equals([(2, 1), (3, 1), (4, 2)], self.graph.substitutes(1))
+        tools.assert_equals([(3, 1), (4, 2)], self.graph.substitutes(2))
+
+    def test_depth_limits(self):
+        tools.assert_equals([(2, 1), (3, 1)], self.graph.substitutes(1, depth=1))
+        tools.assert_equals([], self.graph.substitutes(1, depth=0))
+        tools.assert_equals([], self.graph.substitutes(4))
+
+    def test_replaces(self):
+        tools.assert_equals([(3, 1), (1, 2), (2, 2)], self.graph.replaces(4))
+
+    def test_cycles(self):
+        graph = SubstituteGraph([(1, 2), (2, 1)], max_depth=3)
+        tools.assert_equals([(2, 1)], graph.substitutes(1))
+        tools.assert_equals(set([(1, 2), (2, 1)]), set(graph.pairs()))
+
+
+class TestIngredientIndex(SimpleTestCase):
+
+    def setUp(self):
+        self.index = IngredientIndex([
+            (1, u'Olivov\xfd olej', 'olivovy-olej'),
+            (2, u'\u010cesnek', 'cesnek'),
+            (3, u'Olej', 'olej'),
+            (4, u'Cibule', 'cibule'),
+        ])
+
+    def test_fold_strips_accents_and_case(self):
+        tools.assert_equals(u'olivovy olej', fold(u'Olivov\xfd Olej'))
+
+    def test_whole_names_go_before_words(self):
+        tools.assert_equals([3, 1], [one[0] for one in self.index.search(u'ole')])
+
+    def test_prefix_ignores_accents(self):
+        tools.assert_equals([(2, u'\u010cesnek', 'cesnek')], self.index.search(u'\u010ces'))
+        tools.assert_equals([2, 4], [one[0] for one in self.index.search(u'C')])
+
+    def test_limit(self):
+        tools.assert_equals([2], [one[0] for one in self.index.search(u'c', limit=1)])
+        tools.assert_equals([], self.index.search(u' '))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestIngredientAutocomplete(TransactionTestCase):
+
+    def setUp(self):
+        super(TestIngredientAutocomplete, self).setUp()
+        cache.clear()
+
+    def test_index_follows_ingredient_changes(self):
+        Ingredient.objects.create(name='salt', slug='salt')
+        tools.assert_equals([u'salt'], Ingredient.objects.get_names_list())
+
+        Ingredient.objects.create(name='pepper', slug='pepper')
+        Ingredient.objects.create(name='sugar', slug='sugar', is_approved=False)
+        tools.assert_equals([u'pepper', u'salt'], Ingredient.objects.get_names_list())
+
+    def test_bulk_changes_bump_generation_once(self):
+        generation = get_generation(INGREDIENTS)
+        with transaction.atomic():
+            for name in ('salt', 'pepper', 'sugar'):
+                Ingredient.objects.create(name=name, slug=name)
+
+        tools.assert_equals(generation + 1, get_generation(INGREDIENTS))
+        tools.assert_equals([u'sugar'], [one[1] for one in Ingredient.objects.autocomplete(u'su')])
+
+    def test_recache_rebuilds_index(self):
+        salt = Ingredient.objects.create(name='salt', slug='salt')
+        tools.assert_equals([u'salt'], Ingredient.objects.get_names_list())
+
+        # bypasses signals
+        Ingredient.objects.filter(pk=salt.pk).update(name='sea salt')
+        tools.assert_equals([u'salt'], Ingredient.objects.get_names_list())
+        tools.assert_equals([u'sea salt'], Ingredient.objects.get_names_list(recache=True))
+        tools.assert_equals([u'sea salt'], Ingredient.objects.get_names_list())
+
+
+class TestConversionMatrix(SimpleTestCase):
+
+    def setUp(self):
+        # g, dkg, kg, ml, l
+        self.matrix = ConversionMatrix([
+            (2, 1, Decimal('10')),
+            (3, 2, Decimal('100')),
+            (6, 4, Decimal('1000')),
+        ], [1, 2, 3, 4, 6])
+
+    def test_transitive_and_inverse_ratios(self):
+        tools.assert_equals(Decimal('1000'), self.matrix.ratio(3, 1))
+        tools.assert_equals(Decimal('0.001'), self.matrix.ratio(1, 3))
+        tools.assert_equals(Decimal('1'), self.matrix.ratio(4, 4))
+
+    def test_not_convertible(self):
+        tools.assert_equals(None, self.matrix.ratio(1, 4))
+        tools.assert_false(self.matrix.convertible(3, 6))
+        tools.assert_equals(None, self.matrix.ratio(1, 99))
+
+    def test_convert_many(self):
+        tools.assert_equals(
+            [Decimal('250'), Decimal('2000'), None, None],
+            self.matrix.convert([(Decimal('25'), 2), (Decimal('2'), 3), (Decimal('1'), 4), (None, 1)], 1)
+        )
+        tools.assert_equals([None], self.matrix.convert([(Decimal('1'), 1)], 99))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestUnitConversions(TransactionTestCase):
+
+    def setUp(self):
+        super(TestUnitConversions, self).setUp()
+        cache.clear()
+
+    def test_matrix_follows_conversions_changes(self):
+        tools.assert_equals([None], convert_amounts([(Decimal('2'), 3)], 1))
+
+        UnitConversion.objects.create(from_unit=3, to_unit=2, ratio=100)
+        UnitConversion.objects.create(from_unit=2, to_unit=1, ratio=10)
+        tools.assert_equals([Decimal('2000')], convert_amounts([(Decimal('2'), 3)], 1))
+
+        UnitConversion.objects.filter(from_unit=2).delete()
+        tools.assert_equals([None], convert_amounts([(Decimal('2'), 3)], 1))
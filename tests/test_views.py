@@ -1,17 +1,31 @@
+import json
+from time import time
+
 from django.contrib.auth.models import User, AnonymousUser
 from django.contrib.messages.storage.base import BaseStorage
 from django.contrib.sessions.backends.file import SessionStore
 from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.http import HttpRequest, HttpResponseForbidden
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, RequestFactory
+from django.test.utils import override_settings
+from django.utils import translation
+from django.utils.http import http_date
+from django.utils.translation import get_language
 
+from mock import patch
 from nose import tools
 
 from yummy import conf
-from yummy.models import Category, Cuisine, Recipe, Ingredient, IngredientGroup, CookBook
+from yummy.models import (
+    Category, Cuisine, Recipe, Ingredient, IngredientGroup, CookBook, CookBookRecipe, Photo, RecipePhoto, RecipeRating,
+    IngredientInRecipe, SubstituteIngredient
+)
+from yummy.sitemaps import RecipeSitemap, sitemap
 from yummy.views import FavoriteRecipeAdd, CookBookRemove, CookBookAdd
 
+from tests.test_models import LOCMEM_CACHES
+
 
 def init_request():
     request = HttpRequest()
@@ -75,6 +89,254 @@ class TestViews(TestCase):
         self.client.get(reverse('yummy:authors_list'))
         self.client.get(reverse('yummy:author_recipes', args=(self.user.pk,)))
 
+    @patch('yummy.conf.LISTING_KEYSET_PAGINATION', True)
+    @patch('yummy.views.CategoryDetail.paginate_by', 1)
+    def test_category_keyset_pagination(self):
+        url = reverse('yummy:category_detail', args=(self.cat.path,))
+        Recipe.objects.create(title='bar', category=self.cat, preparation_time=10, owner=self.user, is_approved=True)
+        Recipe.objects.filter(pk=self.recipe.pk).update(is_approved=True)
+
+        response = self.client.get(url)
+        tools.assert_equals(None, response.context['paginator'])
+        cursor = response.context['page_obj'].next_cursor
+        tools.assert_true(cursor)
+
+        response = self.client.get(url, {'cursor': cursor})
+        tools.assert_equals([self.recipe], list(response.context['object_list']))
+        tools.assert_false(response.context['page_obj'].has_next())
+
+        tools.assert_equals(404, self.client.get(url, {'cursor': 'foo'}).status_code)
+
+    def test_ingredient_detail_lists_public_recipes(self):
+        hidden = Recipe.objects.create(title='bar', category=self.cat, preparation_time=10, owner=self.user, is_public=False)
+        Recipe.objects.filter(pk=self.recipe.pk).update(is_approved=True)
+        for recipe in (self.recipe, hidden):
+            IngredientInRecipe.objects.create(recipe=recipe, ingredient=self.ingredient)
+
+        response = self.client.get(self.ingredient.get_absolute_url())
+        tools.assert_equals([self.recipe], list(response.context['object_list']))
+
+        response = self.client.get(reverse('yummy:ingredient_index'))
+        tools.assert_equals([1], [one.recipes_count for one in response.context['object_list']])
+
+    def test_ingredient_detail_pages_past_cached_ids_are_queried(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(is_approved=True)
+        older = Recipe.objects.get(pk=self.recipe.pk)
+        newer = Recipe.objects.create(title='bar', category=self.cat, preparation_time=10, owner=self.user, is_approved=True)
+        for recipe in (older, newer):
+            IngredientInRecipe.objects.create(recipe=recipe, ingredient=self.ingredient)
+
+        with patch('yummy.conf.INGREDIENT_RECIPE_IDS_MAX', 1), patch('yummy.views.IngredientDetail.paginate_by', 1):
+            response = self.client.get(self.ingredient.get_absolute_url())
+            tools.assert_equals([newer], list(response.context['object_list']))
+            tools.assert_equals(2, response.context['paginator'].count)
+
+            response = self.client.get(self.ingredient.get_absolute_url(), {'page': 2})
+            tools.assert_equals([older], list(response.context['object_list']))
+
+    def test_category_photo_filter(self):
+        photo = Photo.objects.create(width=1, height=1, owner=self.user)
+        with_photo = Recipe.objects.create(title='bar', category=self.cat, preparation_time=10, owner=self.user, is_approved=True)
+        RecipePhoto.objects.create(recipe=with_photo, photo=photo)
+        Recipe.objects.filter(pk=self.recipe.pk).update(is_approved=True)
+
+        self.client.cookies[conf.CATEGORY_PHOTO_ATTR] = 'photos'
+        response = self.client.get(reverse('yummy:category_detail', args=(self.cat.path,)))
+
+        tools.assert_equals([with_photo], list(response.context['object_list']))
+
+    @patch('yummy.conf.LISTING_URL_ORDERING', True)
+    def test_category_url_ordering(self):
+        url = reverse('yummy:category_index')
+        other = Recipe.objects.create(title='bar', category=self.cat, preparation_time=10, owner=self.user, is_approved=True)
+        Recipe.objects.filter(pk=self.recipe.pk).update(is_approved=True)
+
+        response = self.client.get(url, {'order': 'title', 'photo': 'all'})
+        tools.assert_equals([other, self.recipe], list(response.context['object_list']))
+        tools.assert_equals('order=title&photo=all&', response.context['listing_query'])
+
+        # cookie doesn't change the response, only redirects to preferred url
+        self.client.cookies[conf.CATEGORY_ORDER_ATTR] = '-created'
+        response = self.client.get(url, {'order': 'title', 'photo': 'all'})
+        tools.assert_equals([other, self.recipe], list(response.context['object_list']))
+
+        self.client.cookies[conf.CATEGORY_ORDER_ATTR] = 'title'
+        response = self.client.get(url)
+        tools.assert_equals(302, response.status_code)
+        tools.assert_true(response['Location'].endswith('%s?order=title&photo=all' % url))
+        tools.assert_equals('Cookie', response['Vary'])
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    @patch('yummy.conf.LISTING_URL_ORDERING', True)
+    def test_bare_category_url_varies_on_cookie(self):
+        cache.clear()
+        url = reverse('yummy:category_detail', args=(self.cat.path,))
+
+        response = self.client.get(url)
+        tools.assert_equals(200, response.status_code)
+        tools.assert_true('Cookie' in response['Vary'])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        tools.assert_equals(304, response.status_code)
+        tools.assert_true('Cookie' in response['Vary'])
+
+        response = self.client.get(url, {'order': 'title', 'photo': 'all'})
+        tools.assert_false(response.has_header('Vary'))
+
+    @patch('yummy.conf.LISTING_URL_ORDERING', True)
+    def test_reorder_redirects_to_ordered_url(self):
+        response = self.client.get(reverse('yummy:category_reorder', args=('title', 'photos')), {'next_url': '/foo/?page=3&x=1'})
+
+        tools.assert_equals(302, response.status_code)
+        tools.assert_true(response['Location'].endswith('/foo/?x=1&order=title&photo=photos'))
+        tools.assert_equals('title', response.cookies[conf.CATEGORY_ORDER_ATTR].value)
+
+    def test_category_by_rating(self):
+        best = Recipe.objects.create(title='bar', category=self.cat, preparation_time=10, owner=self.user, is_approved=True)
+        Recipe.objects.filter(pk=self.recipe.pk).update(is_approved=True)
+        RecipeRating.objects.add_vote(best.pk, 5)
+
+        self.client.cookies[conf.CATEGORY_ORDER_ATTR] = 'by_rating'
+        response = self.client.get(reverse('yummy:category_index'))
+
+        tools.assert_equals([best, self.recipe], list(response.context['object_list']))
+
+    def test_ingredient_match(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(is_approved=True)
+        IngredientInRecipe.objects.create(recipe=self.recipe, ingredient=self.ingredient)
+
+        response = self.client.get(reverse('yummy:ingredient_match'), {'ingredient': [self.ingredient.pk]})
+
+        tools.assert_equals(200, response.status_code)
+        tools.assert_equals(
+            [{'title': 'foo', 'link': self.recipe.get_absolute_url(), 'matched': 1, 'missing': 0}],
+            json.loads(response.content)
+        )
+
+    def test_ingredient_autocomplete(self):
+        response = self.client.get(reverse('yummy:ingredient_autocomplete'), {'q': 'ingr'})
+
+        tools.assert_equals(
+            [{'name': 'ingredient', 'link': self.ingredient.get_absolute_url()}],
+            json.loads(response.content)
+        )
+
+    def test_ingredient_match_rejects_invalid_ids(self):
+        response = self.client.get(reverse('yummy:ingredient_match'), {'ingredient': 'salt'})
+        tools.assert_equals(400, response.status_code)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestRecipeDetailCache(TransactionTestCase):
+
+    def setUp(self):
+        super(TestRecipeDetailCache, self).setUp()
+        cache.clear()
+        self.user = User.objects.create(username='user')
+        self.cat = Category.objects.create(title="foo", path='foo')
+        self.recipe = Recipe.objects.create(title='foo', category=self.cat, preparation_time=10, owner=self.user)
+        self.ingredient = Ingredient.objects.create(name='salt', default_unit=conf.UNIT_CHOICES[0][0])
+
+    def test_detail_is_served_from_cache(self):
+        self.client.get(self.recipe.get_absolute_url())
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.recipe.get_absolute_url())
+        tools.assert_equals(200, response.status_code)
+        tools.assert_true('<h1>foo</h1>' in response.context['recipe_fragment'])
+
+    def test_ingredient_change_bumps_detail_version(self):
+        self.client.get(self.recipe.get_absolute_url())
+        IngredientInRecipe.objects.create(recipe=self.recipe, ingredient=self.ingredient)
+
+        response = self.client.get(self.recipe.get_absolute_url())
+        tools.assert_true('salt' in response.context['recipe_fragment'])
+
+    def test_ingredient_rename_and_new_substitute_show_up(self):
+        IngredientInRecipe.objects.create(recipe=self.recipe, ingredient=self.ingredient)
+        etag = self.client.get(self.recipe.get_absolute_url())['ETag']
+
+        self.ingredient.name = 'sea salt'
+        self.ingredient.save()
+        response = self.client.get(self.recipe.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        tools.assert_equals(200, response.status_code)
+        tools.assert_true('sea salt' in response.context['recipe_fragment'])
+
+        substitute = Ingredient.objects.create(name='soy sauce', slug='soy-sauce')
+        SubstituteIngredient.objects.create(ingredient=self.ingredient, substitute=substitute)
+        response = self.client.get(self.recipe.get_absolute_url(), HTTP_IF_NONE_MATCH=response['ETag'])
+        tools.assert_equals(200, response.status_code)
+        tools.assert_true('soy sauce' in response.context['recipe_fragment'])
+
+    def test_fragment_is_cached_per_language(self):
+        render = lambda detail: get_language()
+        with translation.override('cs'):
+            tools.assert_equals('cs', Recipe.objects.get_detail(self.recipe.pk, render)['fragment'])
+            etag = self.client.get(self.recipe.get_absolute_url())['ETag']
+        with translation.override('en'):
+            tools.assert_equals('en', Recipe.objects.get_detail(self.recipe.pk, render)['fragment'])
+            tools.assert_not_equals(etag, self.client.get(self.recipe.get_absolute_url())['ETag'])
+
+    def test_cookbook_membership_stays_out_of_cache(self):
+        self.client.get(self.recipe.get_absolute_url())
+        user = User.objects.create_user(username='cook', password='pass')
+        cookbook = CookBook.objects.create(owner=user, title='favs')
+        CookBookRecipe.objects.create(cookbook=cookbook, recipe=self.recipe)
+        self.client.login(username='cook', password='pass')
+
+        response = self.client.get(self.recipe.get_absolute_url())
+        tools.assert_equals([cookbook.pk], [one.cookbook_id for one in response.context['cookbook_items']])
+
+    def test_unchanged_detail_is_not_modified(self):
+        response = self.client.get(self.recipe.get_absolute_url())
+        etag = response['ETag']
+        tools.assert_false(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.recipe.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        tools.assert_equals(304, response.status_code)
+
+        self.recipe.save()
+        response = self.client.get(self.recipe.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        tools.assert_equals(200, response.status_code)
+
+    def test_private_detail_is_not_validated(self):
+        etag = self.client.get(self.recipe.get_absolute_url())['ETag']
+        self.recipe.is_public = False
+        self.recipe.save()
+
+        response = self.client.get(self.recipe.get_absolute_url(), HTTP_IF_NONE_MATCH=etag)
+        tools.assert_equals(403, response.status_code)
+        tools.assert_false(response.has_header('ETag'))
+
+    def test_ingredient_added_after_if_modified_since(self):
+        self.client.get(self.recipe.get_absolute_url())
+        IngredientInRecipe.objects.create(recipe=self.recipe, ingredient=self.ingredient)
+
+        response = self.client.get(self.recipe.get_absolute_url(), HTTP_IF_MODIFIED_SINCE=http_date(time() + 60))
+        tools.assert_equals(200, response.status_code)
+
+    def test_unchanged_listing_is_not_modified(self):
+        url = reverse('yummy:category_detail', args=(self.cat.path,))
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(0):
+            tools.assert_equals(304, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+
+        Recipe.objects.create(title='bar', category=self.cat, preparation_time=10, owner=self.user)
+        tools.assert_equals(200, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+
+    def test_unchanged_sitemap_is_not_modified(self):
+        request = RequestFactory().get('/sitemap.xml')
+        etag = sitemap(request, sitemaps={'recipes': RecipeSitemap})['ETag']
+
+        request = RequestFactory().get('/sitemap.xml', HTTP_IF_NONE_MATCH=etag)
+        tools.assert_equals(304, sitemap(request, sitemaps={'recipes': RecipeSitemap}).status_code)
+
+    def test_wrong_slug_is_not_found(self):
+        response = self.client.get(reverse('yummy:recipe_detail', args=(self.cat.path, 'bar', self.recipe.pk)))
+        tools.assert_equals(404, response.status_code)
+
 
 class TestCookBookViews(TestCase):
 
@@ -108,6 +370,14 @@ class TestCookBookViews(TestCase):
 
         tools.assert_equals(1, CookBook.objects.filter(owner=self.user).count())
 
+    def test_cookbook_print(self):
+        cookbook = CookBook.objects.create(owner=self.user, title='foo')
+        CookBookRecipe.objects.create(cookbook=cookbook, recipe=self.recipe)
+
+        response = self.client.get(reverse('yummy:cookbook_print', args=('user', self.user.pk, cookbook.slug)))
+        tools.assert_equals(200, response.status_code)
+        tools.assert_equals([self.recipe], response.context['object_list'])
+
     def test_delete_default_cookbook_returns_403(self):
         CookBook.objects.create(is_default=True, owner=self.user, title='foo')
 
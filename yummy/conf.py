@@ -79,13 +79,19 @@ RECIPE_RECOMMENDATIONS_COUNT = 3
 
 CATEGORY_ORDER_DEFAULT = getattr(settings, 'YUMMY_CATEGORY_ORDER', '-created')
 CATEGORY_ORDERING = {
-    'by_rating': _("by ranking"),  # TODO - add ranking
+    'by_rating': _("by ranking"),
     'title': _("by alphabet"),
     '-created': _("by date"),
 }
 CATEGORY_PHOTO_OPTIONS = ('all', 'photos')
 CATEGORY_ORDER_ATTR = 'category_order_attr'
 CATEGORY_PHOTO_ATTR = 'category_photo_attr'
+# read listing ordering and photo filter from query string instead of cookies, see ListingOrderMixin
+LISTING_URL_ORDERING = getattr(settings, 'YUMMY_LISTING_URL_ORDERING', False)
+CATEGORY_ORDER_PARAM = 'order'
+CATEGORY_PHOTO_PARAM = 'photo'
+# category listings filter subtrees up to this many categories by list of ids, bigger ones by path prefix
+CATEGORY_SUBTREE_IDS_MAX = getattr(settings, 'YUMMY_CATEGORY_SUBTREE_IDS_MAX', 50)
 
 WEEK_DAYS = (
     (1, _("Monday")),
@@ -115,7 +121,11 @@ MONTHS = (
 PHOTO_ORDER_GAP = 5
 
 # get function to be load and get qs as arg to return qs by rating
-FUNC_QS_BY_RATING = getattr(settings, 'YUMMY_FUNC_QS_BY_RATING', None)
+FUNC_QS_BY_RATING = getattr(settings, 'YUMMY_FUNC_QS_BY_RATING', 'yummy.utils.rating.order_by_rating')
+
+# score of RecipeRating is average of votes with RATING_PRIOR_VOTES votes of RATING_PRIOR_MEAN added
+RATING_PRIOR_MEAN = getattr(settings, 'YUMMY_RATING_PRIOR_MEAN', 3)
+RATING_PRIOR_VOTES = getattr(settings, 'YUMMY_RATING_PRIOR_VOTES', 5)
 
 CACHE_TIMEOUT = 60 * 10
 CACHE_TIMEOUT_LONG = 60 * 60 * 1
@@ -125,7 +135,27 @@ CACHE_PREFIX = 'yummy:dummy'
 _CACHE_FUNCTION = getattr(settings, 'YUMMY_CACHE_OBJECT_FUNC', 'yummy.utils.cache.get_cached_model')
 GET_CACHE_FUNCTION = lambda: import_module_member(_CACHE_FUNCTION)
 LISTING_PAGINATE_BY = getattr(settings, 'YUMMY_LISTING_PAGINATE_BY', 15)
+# paginate recipe listings by cursor instead of page number where ordering allows it
+LISTING_KEYSET_PAGINATION = getattr(settings, 'YUMMY_LISTING_KEYSET_PAGINATION', False)
+LISTING_CURSOR_PARAM = 'cursor'
+# listings expected by database to be bigger than this are counted from its statistics, None to always count
+LISTING_COUNT_ESTIMATE_FROM = getattr(settings, 'YUMMY_LISTING_COUNT_ESTIMATE_FROM', None)
 
 GET_THUMBNAIL_FUNC = getattr(settings, 'YUMMY_GET_THUMBNAIL_FUNC', None)
 
+# function called with name and args of cache rebuild task, to run them in background worker
+RECACHE_HANDLER = getattr(settings, 'YUMMY_RECACHE_HANDLER', None)
+
+# ingredient matcher applies up to this many logged recipe changes, it's rebuilt from db if there are more
+MATCHING_MAX_CHANGES = getattr(settings, 'YUMMY_MATCHING_MAX_CHANGES', 1000)
+
+# substitutes of substitutes are looked up up to this many steps
+SUBSTITUTES_MAX_DEPTH = getattr(settings, 'YUMMY_SUBSTITUTES_MAX_DEPTH', 3)
+
+# ingredient -> recipes index caches at most this many newest recipe ids per ingredient, older pages are queried
+INGREDIENT_RECIPE_IDS_MAX = getattr(settings, 'YUMMY_INGREDIENT_RECIPE_IDS_MAX', 1000)
+
+# number of ingredients suggested by autocomplete
+AUTOCOMPLETE_LIMIT = getattr(settings, 'YUMMY_AUTOCOMPLETE_LIMIT', 10)
+
 DEFAULT_COOKBOOK = _("Favorite recipes")
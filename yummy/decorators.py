@@ -30,9 +30,38 @@ def cache_method_with_obj(func):
     return new_func
 
 
+def cache_bulk_method_with_objs(func, method_name):
+    """
+    cache results of method taking list of objects and returning dict of \
+        results by object's pk, results are cached per object under keys \
+        of ``method_name`` cached by ``cache_method_with_obj``, so both \
+        share cache; all keys are read at once, misses loaded by single call
+    """
+    @wraps(func)
+    def new_func(self, objs):
+        keys = dict((self.__class__.cache_manager_key(method_name, obj), obj) for obj in objs)
+        cached = cache.get_many(keys.keys()) if keys else {}
+        res = dict((keys[key].pk, value) for key, value in cached.items())
+
+        missing = dict((key, obj) for key, obj in keys.items() if key not in cached)
+        if missing:
+            loaded = func(self, missing.values())
+            missing = dict((key, list(loaded.get(obj.pk, ()))) for key, obj in missing.items())
+            cache.set_many(missing, timeout=conf.CACHE_TIMEOUT)
+            res.update((keys[key].pk, value) for key, value in missing.items())
+        return res
+
+    return new_func
+
+
 def add_cached_methods(cls):
 
     for method in cls.CACHE_METHODS:
         cached_method = '%s_cached' % method
         setattr(cls, cached_method, cache_method_with_obj(getattr(cls, method)))
+
+    # bulk variant of method: method name
+    for bulk_method, method in getattr(cls, 'CACHE_BULK_METHODS', {}).items():
+        cached_method = '%s_cached' % bulk_method
+        setattr(cls, cached_method, cache_bulk_method_with_objs(getattr(cls, bulk_method), method))
     return cls
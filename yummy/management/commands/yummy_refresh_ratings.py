@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from yummy.models import RecipeRating
+
+
+class Command(BaseCommand):
+    help = "Create missing recipe ratings and recompute rating scores, use after change of rating settings."
+
+    def handle(self, *args, **options):
+        created = RecipeRating.objects.refresh()
+        self.stdout.write("%d ratings created, %d scores refreshed" % (created, RecipeRating.objects.count()))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from yummy.models import Recipe
+
+
+class Command(BaseCommand):
+    help = "Store top photo of every recipe to its main_photo and has_photo, use after import or to fix inconsistencies."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, dest='batch_size',
+                            help="Number of recipes updated at once.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        recipe_ids = list(Recipe.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(recipe_ids), batch_size):
+            Recipe.objects.update_main_photos(recipe_ids[start:start + batch_size])
+
+        self.stdout.write("%d recipes updated" % len(recipe_ids))
@@ -1,8 +1,14 @@
 from datetime import date
 from django.core.cache import cache
 from django.db import models
+from django.utils.translation import get_language
 
 from yummy.utils import get_model
+from yummy.utils.autocomplete import get_ingredient_index
+from yummy.utils.cache import INGREDIENTS, get_generations, bump_generation
+from yummy.utils.matching import match
+from yummy.utils.substitutes import SUBSTITUTE_GRAPH, get_substitute_graph
+from yummy.utils.tree import CATEGORY_TREE, get_category_tree
 from yummy.decorators import add_cached_methods
 from yummy import conf
 
@@ -50,8 +56,97 @@ class CategoryManager(models.Manager):
     # backward compatibility
     get_query_set = get_queryset
 
+    def subtree(self, category):
+        return self.filter(category.get_subtree_filter())
 
-class RecipeManager(models.Manager):
+    def _recipes_count_keys(self, generation):
+        return 'yummy_categories_recipes_counts:%s' % generation, 'yummy_category_recipes_count:%s:%%s' % generation
+
+    def get_recipes_counts(self, recache=False):
+        """
+        count public recipes of every category including its subcategories, \
+            direct counts are taken by single aggregate query \
+            and summed up the category tree in memory
+
+        counts are cached as one counter per category, so they can be \
+            kept up to date by update_recipes_count()
+
+        :param recache: force recache
+        :type recache: bool
+        :return: recipes count by category pk
+        :rtype: dict
+        """
+        tree = get_category_tree()
+        marker_key, count_key = self._recipes_count_keys(tree.generation)
+        keys = dict((count_key % pk, pk) for pk in tree.pks())
+
+        cached = {} if recache else cache.get_many([marker_key] + list(keys))
+        if marker_key in cached and len(cached) == len(keys) + 1:
+            return dict((pk, cached[key]) for key, pk in keys.items())
+
+        counts = dict.fromkeys(keys.values(), 0)
+        direct_counts = get_model('yummy', 'recipe').objects.public().order_by().\
+            values_list('category').annotate(models.Count('pk'))
+        for category_id, count in direct_counts:
+            for pk in tree.ancestor_pks(category_id) + (category_id,):
+                counts[pk] = counts.get(pk, 0) + count
+
+        to_cache = dict((count_key % pk, count) for pk, count in counts.items())
+        cache.set_many(to_cache)
+        # marker goes last, counters are complete only if it's present
+        cache.set(marker_key, True)
+        return counts
+
+    def get_recipes_count(self, category_id, recache=False):
+        """
+        recipes count of single category read from its own counter, \
+            all categories are counted only if counters are not complete
+
+        :param category_id: category pk
+        :type category_id: int
+        :return: count of public recipes including subcategories
+        :rtype: int
+        """
+        if not recache:
+            marker_key, count_key = self._recipes_count_keys(get_category_tree().generation)
+            cached = cache.get_many([marker_key, count_key % category_id])
+            if len(cached) == 2:
+                return cached[count_key % category_id]
+        return self.get_recipes_counts(recache).get(category_id, 0)
+
+    def invalidate_recipes_counts(self):
+        marker_key, count_key = self._recipes_count_keys(get_category_tree().generation)
+        cache.delete(marker_key)
+
+    def update_recipes_count(self, category_id, delta):
+        """
+        apply delta to cached recipes count of the category and its ancestors
+
+        :param category_id: category pk
+        :type category_id: int
+        :param delta: change of public recipes count
+        :type delta: int
+        """
+        tree = get_category_tree()
+        marker_key, count_key = self._recipes_count_keys(tree.generation)
+        for pk in tree.ancestor_pks(category_id) + (category_id,):
+            try:
+                cache.incr(count_key % pk, delta)
+            except ValueError:
+                # counter is gone, let the whole tree be counted again
+                self.invalidate_recipes_counts()
+                return
+
+
+class RecipeQuerySet(models.QuerySet):
+
+    CARD_FIELDS = (
+        'title', 'slug', 'category', 'owner', 'main_photo', 'is_approved', 'is_public',
+        'servings', 'price', 'difficulty', 'preparation_time', 'caloric_value', 'created', 'updated',
+        'category__parent', 'category__title', 'category__slug', 'category__photo', 'category__path',
+        'owner__username', 'owner__first_name', 'owner__last_name',
+        'main_photo__image', 'main_photo__width', 'main_photo__height', 'main_photo__title', 'main_photo__owner',
+    )
 
     def public(self):
         return self.approved().filter(is_public=True)
@@ -62,6 +157,185 @@ class RecipeManager(models.Manager):
     def checked(self):
         return self.public().filter(is_checked=True)
 
+    def in_category(self, category):
+        """
+        recipes of given category and all its subcategories
+
+        small subtrees (up to YUMMY_CATEGORY_SUBTREE_IDS_MAX categories) \
+            are resolved from category tree to category ids, so listing \
+            is served by category index without join; bigger ones are \
+            matched by single path prefix predicate, see \
+            Category.get_subtree_filter, instead of long list of ids
+        """
+        pks = category.get_subtree_pks()
+        if len(pks) <= conf.CATEGORY_SUBTREE_IDS_MAX:
+            return self.filter(category__in=pks)
+        return self.filter(category.get_subtree_filter('category__'))
+
+    def cards(self):
+        """
+        lean mode for recipe listings - loads only columns recipe cards \
+            render and joins only relations they need (category for url \
+            and photo fallback, owner's name and top photo)
+        """
+        return self.select_related(None).select_related('category', 'owner', 'main_photo').only(*self.CARD_FIELDS)
+
+
+class RecipeManager(models.Manager.from_queryset(RecipeQuerySet)):
+
+    def attach_groupped_ingredients(self, recipes):
+        """
+        load groupped ingredients of all given recipes at once - single \
+            cache round-trip and single query for recipes not cached yet, \
+            see Recipe.groupped_ingredients
+
+        :param recipes: recipes to attach groupped ingredients to
+        :type recipes: list
+        :return: given recipes
+        :rtype: list
+        """
+        keys = dict(('%s_groupped_ingredients' % one.pk, one) for one in recipes
+                    if not hasattr(one, '_groupped_ingredients'))
+        groups = cache.get_many(keys.keys()) if keys else {}
+
+        missing = [one.pk for key, one in keys.items() if key not in groups]
+        if missing:
+            items = {}
+            qs = get_model('yummy', 'ingredientinrecipe').objects.filter(recipe__in=missing).\
+                select_related('ingredient', 'group').order_by('group__order', 'order')
+            for one in qs:
+                items.setdefault(one.recipe_id, []).append(one)
+
+            missing_groups = dict(
+                ('%s_groupped_ingredients' % pk, self.model.group_ingredients(items.get(pk, ())))
+                for pk in missing
+            )
+            cache.set_many(missing_groups)
+            groups.update(missing_groups)
+
+        for key, recipe in keys.items():
+            recipe._groupped_ingredients = groups[key]
+        return recipes
+
+    def attach_top_photos(self, recipes):
+        """
+        resolve top photos of all given recipes at once - photos not loaded \
+            by select_related('main_photo') are fetched by single query, \
+            see Recipe.get_top_photo
+
+        :param recipes: recipes to attach top photo to
+        :type recipes: list
+        :return: given recipes
+        :rtype: list
+        """
+        cache_name = self.model._meta.get_field('main_photo').get_cache_name()
+        recipes = [one for one in recipes if 'top_photo' not in one.__dict__]
+
+        missing = set(one.main_photo_id for one in recipes
+                      if one.main_photo_id is not None and not hasattr(one, cache_name))
+        photos = get_model('yummy', 'photo').objects.in_bulk(missing) if missing else {}
+
+        for recipe in recipes:
+            if recipe.main_photo_id in photos:
+                setattr(recipe, cache_name, photos[recipe.main_photo_id])
+            recipe.__dict__['top_photo'] = recipe.get_top_photo()
+        return recipes
+
+    def update_main_photos(self, recipe_ids):
+        """
+        store top photo of given recipes to denormalized Recipe.main_photo \
+            and Recipe.has_photo, owner's photos first, see Recipe.get_photos
+
+        :param recipe_ids: pks of recipes to update
+        :type recipe_ids: list
+        """
+        owners = dict(self.filter(pk__in=recipe_ids).order_by().values_list('pk', 'owner_id'))
+        if not owners:
+            return
+
+        items = {}
+        qs = get_model('yummy', 'recipephoto').objects.visible().filter(recipe__in=owners.keys()).\
+            select_related('photo').order_by('order')
+        for one in qs:
+            items.setdefault(one.recipe_id, []).append(one)
+
+        recipes_by_photo = {}
+        for pk, owner_id in owners.items():
+            photos = self.model.arrange_photos(items.get(pk, ()), owner_id)
+            recipes_by_photo.setdefault(photos[0].pk if photos else None, []).append(pk)
+
+        for photo_id, pks in recipes_by_photo.items():
+            self.filter(pk__in=pks).update(main_photo=photo_id, has_photo=photo_id is not None)
+
+    def match_ingredients(self, ingredient_ids, min_matched=1, max_missing=None, substitutes=False, limit=None):
+        """
+        public recipes cookable from given ingredients, ones missing \
+            fewest ingredients first, answered by in-memory matcher, \
+            see yummy.utils.matching.IngredientMatcher.match
+
+        :param ingredient_ids: pks of ingredients user has
+        :type ingredient_ids: list
+        :return: matches - recipe_id, matched and missing counts
+        :rtype: list
+        """
+        return match(ingredient_ids, min_matched, max_missing, substitutes, limit)
+
+    def _detail_generation_name(self, recipe_id):
+        return 'recipe_detail:%s' % recipe_id
+
+    def get_detail_version(self, recipe_id):
+        """
+        :return: generations of recipe, category tree, ingredients and \
+            substitutes, detail is cached under
+        :rtype: list
+        """
+        return get_generations([self._detail_generation_name(recipe_id), CATEGORY_TREE, INGREDIENTS, SUBSTITUTE_GRAPH])
+
+    def invalidate_detail(self, recipe_id):
+        bump_generation(self._detail_generation_name(recipe_id))
+
+    def get_detail(self, recipe_id, render=None):
+        """
+        recipe with everything its detail page shows - ingredients with \
+            their substitutes, photos and cuisines, cached under version \
+            bumped on any change of the recipe, its ingredients or photos
+
+        :param recipe_id: pk of recipe
+        :type recipe_id: int
+        :param render: function rendering public fragment of the detail, \
+            called with the detail, rendered fragment is cached along, \
+            per active language
+        :type render: callable
+        :return: dict with recipe as object, photos, cuisines and fragment, \
+            None if recipe doesn't exist
+        :rtype: dict
+        """
+        recipe_id = int(recipe_id)
+        key = '%s:recipe_detail:%s:%s:%s' % (conf.CACHE_PREFIX, recipe_id, get_language(),
+                                             ':'.join(map(str, self.get_detail_version(recipe_id))))
+
+        detail = cache.get(key)
+        if detail is None:
+            try:
+                recipe = self.select_related(None).select_related('category', 'owner', 'main_photo', 'cooking_type').\
+                    get(pk=recipe_id)
+            except self.model.DoesNotExist:
+                return None
+
+            get_model('yummy', 'substituteingredient').objects.attach_to_ingredients([
+                item.ingredient for group_title, group in recipe.groupped_ingredients() for item in group['items']
+            ])
+
+            detail = {
+                'object': recipe,
+                'photos': recipe.get_photos(),
+                'cuisines': list(recipe.cuisines.all()),
+            }
+            if render is not None:
+                detail['fragment'] = render(detail)
+            cache.set(key, detail, conf.CACHE_TIMEOUT_LONG)
+        return detail
+
     def get_queryset(self):
         parent = super(RecipeManager, self)
         queryset_method = hasattr(parent, 'get_queryset') and getattr(parent, 'get_queryset') or getattr(parent, 'get_query_set')
@@ -71,6 +345,62 @@ class RecipeManager(models.Manager):
     get_query_set = get_queryset
 
 
+class RecipeRatingManager(models.Manager):
+
+    def compute_score(self, votes_count, votes_sum):
+        """
+        bayesian average - YUMMY_RATING_PRIOR_VOTES fictive votes \
+            of YUMMY_RATING_PRIOR_MEAN added to real votes
+
+        :rtype: float
+        """
+        prior_votes = conf.RATING_PRIOR_VOTES
+        return (prior_votes * conf.RATING_PRIOR_MEAN + votes_sum) / float(prior_votes + votes_count)
+
+    def _score_expression(self, count_delta=0, sum_delta=0):
+        prior_votes = conf.RATING_PRIOR_VOTES
+        return models.ExpressionWrapper(
+            (models.Value(float(prior_votes * conf.RATING_PRIOR_MEAN + sum_delta)) + models.F('votes_sum')) /
+            (models.Value(float(prior_votes + count_delta)) + models.F('votes_count')),
+            output_field=models.FloatField()
+        )
+
+    def add_vote(self, recipe_id, value):
+        """
+        add single vote to recipe rating, counters and score are updated \
+            by single query, safe for concurrent votes
+
+        :param recipe_id: pk of voted recipe
+        :type recipe_id: int
+        :param value: vote
+        :type value: int
+        """
+        updated = self.filter(pk=recipe_id).update(
+            votes_count=models.F('votes_count') + 1,
+            votes_sum=models.F('votes_sum') + value,
+            score=self._score_expression(1, value),
+        )
+        if not updated:
+            self.create(recipe_id=recipe_id, votes_count=1, votes_sum=value)
+
+    def set_votes(self, recipe_id, votes_count, votes_sum):
+        """store votes aggregated elsewhere, e.g. by external rating app"""
+        self.update_or_create(recipe_id=recipe_id, defaults={'votes_count': votes_count, 'votes_sum': votes_sum})
+
+    def refresh(self):
+        """
+        create missing ratings and recompute all scores, use after \
+            change of YUMMY_RATING_PRIOR_* settings
+
+        :return: number of created ratings
+        :rtype: int
+        """
+        missing = get_model('yummy', 'recipe').objects.filter(rating__isnull=True).order_by().values_list('pk', flat=True)
+        created = self.bulk_create([self.model(recipe_id=pk) for pk in missing])
+        self.update(score=self._score_expression())
+        return len(created)
+
+
 class RecipeRecommendationManager(models.Manager):
 
     def get_actual(self):
@@ -111,12 +441,106 @@ class IngredientManager(models.Manager):
         return self.filter(is_approved=True)
 
     def get_names_list(self, recache=False):
-        cache_key = 'ingredient_get_names_list'
-        ingredients = cache.get(cache_key)
-        if ingredients is None or recache:
-            ingredients = self.approved().values_list('name', flat=True)
-            cache.set(cache_key, ingredients)
-        return ingredients
+        """
+        names of approved ingredients, alphabetically, read from \
+            autocomplete index which is rebuilt on any change of ingredients
+
+        :param recache: rebuild the index
+        :type recache: bool
+        """
+        return get_ingredient_index(recache).names()
+
+    def autocomplete(self, prefix, limit=conf.AUTOCOMPLETE_LIMIT):
+        """
+        :param prefix: typed part of ingredient name
+        :type prefix: unicode
+        :param limit: maximal number of results
+        :type limit: int
+        :return: (pk, name, slug) of approved ingredients, whole name matches first
+        :rtype: list
+        """
+        return get_ingredient_index().search(prefix, limit)
+
+    def get_alternatives(self, ingredient_id, depth=None):
+        """
+        approved ingredients usable instead of given one, including \
+            substitutes of substitutes, see yummy.utils.substitutes
+
+        :param ingredient_id: pk of ingredient
+        :type ingredient_id: int
+        :param depth: maximal number of substitution steps
+        :type depth: int
+        :return: (ingredient, depth) pairs, nearest first
+        :rtype: list
+        """
+        found = get_substitute_graph().substitutes(ingredient_id, depth)
+        ingredients = self.approved().in_bulk([pk for pk, one_depth in found])
+        return [(ingredients[pk], one_depth) for pk, one_depth in found if pk in ingredients]
+
+    def _recipe_index_key(self, ingredient_id):
+        return '%s:ingredient_recipe_index:%s' % (conf.CACHE_PREFIX, ingredient_id)
+
+    def get_recipe_index_many(self, ingredient_ids, recache=False):
+        """
+        ingredient -> recipes index, number of public recipes using given \
+            ingredients and ids of up to YUMMY_INGREDIENT_RECIPE_IDS_MAX \
+            newest of them. Missing entries are built by single query, \
+            IngredientInRecipe and Recipe signals drop changed ones
+
+        :param ingredient_ids: pks of ingredients
+        :type ingredient_ids: list
+        :param recache: force rebuild
+        :type recache: bool
+        :return: ingredient pk -> (count, list of recipe pks)
+        :rtype: dict
+        """
+        keys = dict((self._recipe_index_key(pk), pk) for pk in ingredient_ids)
+        cached = {} if recache else cache.get_many(keys.keys())
+        result = dict((keys[key], entry) for key, entry in cached.items())
+
+        missing = [pk for pk in ingredient_ids if pk not in result]
+        if missing:
+            counts = dict((pk, 0) for pk in missing)
+            ids = dict((pk, []) for pk in missing)
+            qs = get_model('yummy', 'ingredientinrecipe').objects.\
+                filter(ingredient__in=missing, recipe__is_approved=True, recipe__is_public=True).\
+                order_by('-recipe').values_list('ingredient', 'recipe').distinct()
+            for ingredient_id, recipe_id in qs.iterator():
+                counts[ingredient_id] += 1
+                if len(ids[ingredient_id]) < conf.INGREDIENT_RECIPE_IDS_MAX:
+                    ids[ingredient_id].append(recipe_id)
+
+            built = dict((pk, (counts[pk], ids[pk])) for pk in missing)
+            cache.set_many(dict((self._recipe_index_key(pk), entry) for pk, entry in built.items()), conf.CACHE_TIMEOUT_LONG)
+            result.update(built)
+        return result
+
+    def get_recipe_index(self, ingredient_id, recache=False):
+        """
+        :return: number of public recipes using the ingredient and ids of newest of them
+        :rtype: tuple
+        """
+        return self.get_recipe_index_many([ingredient_id], recache)[ingredient_id]
+
+    def get_recipe_ids(self, ingredient_id, recache=False):
+        """
+        ids of up to YUMMY_INGREDIENT_RECIPE_IDS_MAX newest public recipes using the ingredient
+        """
+        return self.get_recipe_index(ingredient_id, recache)[1]
+
+    def get_recipes_counts(self, ingredient_ids):
+        """
+        :return: ingredient pk -> number of public recipes using it
+        :rtype: dict
+        """
+        return dict((pk, entry[0]) for pk, entry in self.get_recipe_index_many(ingredient_ids).items())
+
+    def invalidate_recipe_index(self, ingredient_ids):
+        """
+        drop cached index entries of given ingredients, they are rebuilt \
+            when read next time, so bulk changes cost single rebuild
+        """
+        cache.delete_many([self._recipe_index_key(pk) for pk in ingredient_ids])
 
 
 @add_cached_methods
@@ -124,6 +548,9 @@ class SubstituteIngredientManager(models.Manager):
     CACHE_METHODS = (
         'get_for_ingredient',
     )
+    CACHE_BULK_METHODS = {
+        'get_for_ingredients': 'get_for_ingredient',
+    }
 
     @classmethod
     def cache_manager_key(cls, func_name, obj):
@@ -131,3 +558,31 @@ class SubstituteIngredientManager(models.Manager):
 
     def get_for_ingredient(self, ingredient):
         return self.filter(ingredient=ingredient).select_related('substitute')
+
+    def get_for_ingredients(self, ingredients):
+        """
+        :param ingredients: ingredients to load substitutes of
+        :type ingredients: list
+        :return: ingredient pk -> list of its substitutes
+        :rtype: dict
+        """
+        substitutes = {}
+        for one in self.filter(ingredient__in=ingredients).select_related('substitute'):
+            substitutes.setdefault(one.ingredient_id, []).append(one)
+        return substitutes
+
+    def attach_to_ingredients(self, ingredients):
+        """
+        set substitutes of all given ingredients by single cache round-trip \
+            and single query for ingredients not cached yet, see Ingredient.substitutes
+
+        :param ingredients: ingredients, e.g. of all items of recipe
+        :type ingredients: list
+        :return: given ingredients
+        :rtype: list
+        """
+        pending = [one for one in ingredients if 'substitutes' not in one.__dict__]
+        substitutes = self.get_for_ingredients_cached(pending)
+        for one in pending:
+            one.substitutes = substitutes.get(one.pk, [])
+        return ingredients
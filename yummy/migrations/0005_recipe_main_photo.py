@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import models, migrations
+import ella.core.cache.fields
+
+
+def set_main_photo(apps, schema_editor):
+    Recipe = apps.get_model('yummy', 'Recipe')
+    RecipePhoto = apps.get_model('yummy', 'RecipePhoto')
+
+    # same choice as Recipe.arrange_photos, owner's photo goes before others
+    main_photos = {}
+    qs = RecipePhoto.objects.filter(is_visible=True).order_by('order').\
+        values_list('recipe', 'recipe__owner', 'photo', 'photo__owner')
+    for recipe_id, owner_id, photo_id, photo_owner_id in qs.iterator():
+        if recipe_id not in main_photos or photo_owner_id == owner_id:
+            main_photos[recipe_id] = photo_id
+
+    recipes_by_photo = {}
+    for recipe_id, photo_id in main_photos.items():
+        recipes_by_photo.setdefault(photo_id, []).append(recipe_id)
+    for photo_id, pks in recipes_by_photo.items():
+        Recipe.objects.filter(pk__in=pks).update(main_photo=photo_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yummy', '0004_auto_20180224_2304'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='main_photo',
+            field=ella.core.cache.fields.CachedForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, editable=False, to='yummy.Photo', null=True, verbose_name='Top photo'),
+        ),
+        migrations.RunPython(set_main_photo, migrations.RunPython.noop),
+    ]
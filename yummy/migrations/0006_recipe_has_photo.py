@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def set_has_photo(apps, schema_editor):
+    Recipe = apps.get_model('yummy', 'Recipe')
+    RecipePhoto = apps.get_model('yummy', 'RecipePhoto')
+    # from photos themselves, main_photo may not be filled in yet
+    with_photo = RecipePhoto.objects.filter(is_visible=True).values('recipe')
+    Recipe.objects.filter(pk__in=with_photo).update(has_photo=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yummy', '0005_recipe_main_photo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='has_photo',
+            field=models.BooleanField(default=False, verbose_name='Has photo', db_index=True, editable=False),
+        ),
+        migrations.RunPython(set_has_photo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yummy', '0006_recipe_has_photo'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='recipe',
+            index_together=set([
+                ('is_approved', 'is_public', 'created'),
+                ('is_approved', 'is_public', 'title'),
+                ('category', 'is_approved', 'is_public', 'created'),
+                ('owner', 'is_approved', 'is_public', 'created'),
+                ('has_photo', 'is_approved', 'is_public', 'created'),
+            ]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def create_ratings(apps, schema_editor):
+    from yummy import conf
+
+    Recipe = apps.get_model('yummy', 'Recipe')
+    RecipeRating = apps.get_model('yummy', 'RecipeRating')
+    RecipeRating.objects.bulk_create([
+        RecipeRating(recipe_id=pk, score=conf.RATING_PRIOR_MEAN)
+        for pk in Recipe.objects.values_list('pk', flat=True)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('yummy', '0007_recipe_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeRating',
+            fields=[
+                ('recipe', models.OneToOneField(related_name='rating', primary_key=True, serialize=False, to='yummy.Recipe', verbose_name='Recipe')),
+                ('votes_count', models.PositiveIntegerField(default=0, verbose_name='Votes count')),
+                ('votes_sum', models.PositiveIntegerField(default=0, verbose_name='Votes sum')),
+                ('score', models.FloatField(default=0, verbose_name='Score', db_index=True, editable=False)),
+            ],
+            options={
+                'verbose_name': 'Recipe rating',
+                'verbose_name_plural': 'Recipe ratings',
+            },
+        ),
+        migrations.RunPython(create_ratings, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,12 @@
 from os import path
 from hashlib import md5
 from datetime import date
+from functools import partial
 
 from django.db import models
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.core.cache import cache
 from django.conf import settings
 from django.core.exceptions import ValidationError
@@ -19,6 +22,13 @@ from django.utils.encoding import force_text
 from yummy import conf
 from yummy import managers
 from yummy.decorators import recached_method_to_mem
+from yummy.utils.cache import WEEK_MENU, INGREDIENTS, bump_generation
+from yummy.utils.matching import RECIPE as MATCHING_RECIPE, SUBSTITUTES as MATCHING_SUBSTITUTES, record_change
+from yummy.utils.pagination import invalidate_listing_counts
+from yummy.utils.recache import on_commit, recache_task, schedule
+from yummy.utils.substitutes import invalidate_substitute_graph
+from yummy.utils.tree import get_category_tree, invalidate_category_tree
+from yummy.utils.units import invalidate_conversion_matrix
 
 try:
     from ella.core.cache.fields import CachedForeignKey
@@ -108,11 +118,15 @@ class Ingredient(models.Model):
             self.slug = slugify(self.name)
         super(Ingredient, self).save(*args, **kwargs)
 
-        Ingredient.objects.get_names_list(recache=True)
-
     def get_absolute_url(self):
         return reverse('yummy:ingredient_detail', args=(self.slug,))
 
+    @classmethod
+    def _bump_ingredients(cls, *args, **kwargs):
+        # cached groupped ingredients of recipes hold the ingredient, drop them first
+        schedule('recache_ingredient_groups', kwargs.get('instance').pk)
+        schedule('recache_ingredients')
+
     @cached_property
     def substitutes(self):
         return SubstituteIngredient.objects.get_for_ingredient_cached(self)
@@ -147,6 +161,11 @@ class SubstituteIngredient(models.Model):
         if self.ingredient == self.substitute:
             raise ValidationError(_('It is not allowed replacing itself'))
 
+    @classmethod
+    def _bump_substitutes(cls, *args, **kwargs):
+        schedule('recache_ingredient_substitutes', kwargs.get('instance').ingredient_id)
+        schedule('recache_substitute_graph')
+
 
 def upload_to(instance, filename):
     name, ext = path.splitext(filename)
@@ -217,44 +236,65 @@ class Category(models.Model):
         return self.title
 
     def get_root_ancestor(self):
-        if self.parent is not None:
-            return self.parent.get_root_ancestor()
-        return self
+        if self.parent_id is None:
+            return self
+        if self.path:
+            return get_category_tree().get_by_path(self.path.split('/', 1)[0])
+        return get_category_tree().root(self.parent_id)
 
     @property
     def chained_title(self):
-        if self.parent:
-            return "%s / %s" % (self.parent.chained_title, self.title)
-        return self.title
+        if self.parent_id is None:
+            return self.title
+        titles = [one.title for one in get_category_tree().lineage(self.parent_id)]
+        return " / ".join(titles + [self.title])
 
     def get_absolute_url(self):
         return reverse('yummy:category_detail', args=(self.path,))
 
     @property
     def is_root_category(self):
-        return self.parent is None
+        return self.parent_id is None
 
     def is_ancestor_of(self, category=None):
-        if category is None or category.is_root_category:
+        """path encodes whole ancestry, no need to walk the parents"""
+        if category is None or not self.path or not category.path:
             return False
-        if category.parent == self:
-            return True
-        return self.is_ancestor_of(category.parent)
+        return category.path.startswith('%s/' % self.path)
 
     def get_children(self, recache=False):
-        cache_key = "%s_direct_descendants" % self.pk
-        cached_cats = cache.get(cache_key)
-        if cached_cats is None or recache:
-            cached_cats = list(self.__class__.objects.filter(parent=self))
-            cache.set(cache_key, cached_cats)
-        return cached_cats
+        if recache:
+            invalidate_category_tree()
+        if self.pk is None:
+            return []
+        return get_category_tree().children(self.pk)
 
     def get_descendants(self, recache=False):
-        cats = []
-        for child_category in self.get_children(recache):
-            cats += [child_category]
-            cats += child_category.get_descendants()
-        return cats
+        if recache:
+            invalidate_category_tree()
+        if self.pk is None:
+            return []
+        return get_category_tree().descendants(self.pk)
+
+    def get_subtree_filter(self, prefix=''):
+        """
+        Q object matching this category and all its descendants by `path`,
+        usable for joins from related models, e.g. prefix='category__';
+        RecipeQuerySet.in_category uses it for subtrees bigger than
+        YUMMY_CATEGORY_SUBTREE_IDS_MAX categories, smaller ones are
+        filtered by category ids
+
+        :param prefix: lookup prefix leading to category
+        :type prefix: str
+        :return: path = X OR path LIKE 'X/%'
+        :rtype: Q
+        """
+        lookup = '%spath' % prefix
+        return models.Q(**{lookup: self.path}) | models.Q(**{'%s__startswith' % lookup: '%s/' % self.path})
+
+    def get_subtree_pks(self):
+        """pks of this category and all its descendants, taken from category tree"""
+        return [self.pk] + [one.pk for one in get_category_tree().descendants(self.pk)]
 
     @property
     def level(self):
@@ -294,35 +334,41 @@ class Category(models.Model):
         else:
             self.path = self.slug
 
-        super(Category, self).save(**kwargs)
+        path_changed = bool(self.pk and old_path and old_path != self.path)
 
-        if old_path != self.path:
-            if self.parent:
-                self.parent.get_descendants(recache=True)
+        with transaction.atomic():
+            super(Category, self).save(**kwargs)
 
-            # update descendants' path
-            for cat in self.get_descendants():
-                cat.save(force_update=True)
+            if path_changed:
+                # rewrite descendants' path prefix at once
+                self.__class__.objects.filter(path__startswith='%s/' % old_path).update(
+                    path=Concat(Value(self.path), Substr('path', len(old_path) + 1), output_field=models.CharField())
+                )
+
+        # also drops recipes counts, these are cached per tree generation
+        schedule('recache_category_tree')
+
+    @classmethod
+    def _bump_tree(cls, *args, **kwargs):
+        schedule('recache_category_tree')
 
     @property
     def photo_hierarchic(self):
-        if self.photo:
+        if self.photo_id is not None:
+            # take photo loaded in category tree if this instance doesn't have it
+            if not hasattr(self, self._meta.get_field('photo').get_cache_name()):
+                cached = get_category_tree().get(self.pk)
+                if cached is not None and cached.photo_id == self.photo_id:
+                    return cached.photo
             return self.photo
-        if self.parent:
-            return self.parent.photo_hierarchic
+        if self.parent_id is not None:
+            for one in reversed(get_category_tree().lineage(self.parent_id)):
+                if one.photo_id is not None:
+                    return one.photo
         return ""
 
     def get_recipes_count(self, recache=False):
-        cache_key = '%s_subcats_recipes_count' % self.pk
-        recipes_count = cache.get(cache_key)
-        if recipes_count is None or recache:
-            recipes_count = Recipe.objects.filter(is_public=True, is_approved=True, category=self).count()
-            children = Category.objects.filter(parent=self)
-            for one in children:
-                recipes_count += one.get_recipes_count()
-            cache.set(cache_key, recipes_count)
-
-        return recipes_count
+        return self.__class__.objects.get_recipes_count(self.pk, recache)
 
 
 class Recipe(models.Model):
@@ -347,12 +393,19 @@ class Recipe(models.Model):
     caloric_value = models.PositiveIntegerField(_('Caloric value'), blank=True, null=True)
 
     owner = CachedForeignKey(User, verbose_name=_('User'))
+    # denormalized get_photos()[0] and its presence, maintained by RecipePhoto signals
+    main_photo = CachedForeignKey(Photo, verbose_name=_('Top photo'), null=True, blank=True, editable=False,
+                                  related_name='+', on_delete=models.SET_NULL)
+    has_photo = models.BooleanField(_('Has photo'), default=False, editable=False, db_index=True)
     is_approved = models.BooleanField(_('Approved'), default=False, db_index=True)
     is_public = models.BooleanField(_('Public'), default=True)
     is_checked = models.BooleanField(_("Is checked"), default=False)
     created = models.DateTimeField(editable=False, db_index=True)
     updated = models.DateTimeField(editable=False)
 
+    # maintained by RecipeManager.update_main_photos(), left out of save()
+    DENORMALIZED_FIELDS = ('main_photo', 'has_photo')
+
     def __unicode__(self):
         return self.title
 
@@ -363,33 +416,123 @@ class Recipe(models.Model):
 
         if not self.slug:
             self.slug = slugify(self.title)
+
+        # denormalized columns are written by RecipePhoto signals only,
+        # saving instance loaded earlier must not write back stale values
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.DENORMALIZED_FIELDS and f.attname not in deferred
+            ]
         super(Recipe, self).save(**kwargs)
 
-        self.groupped_ingredients(recache=True)
-        self.category.get_recipes_count(recache=True)
+        self.__dict__.pop('_groupped_ingredients', None)
+        schedule('recache_recipe_ingredients', self.pk)
 
     class Meta:
         verbose_name = _('Recipe')
         verbose_name_plural = _('Recipes')
+        # access paths of public listings, see RecipeQuerySet.public
+        index_together = (
+            ('is_approved', 'is_public', 'created'),
+            ('is_approved', 'is_public', 'title'),
+            ('category', 'is_approved', 'is_public', 'created'),
+            ('owner', 'is_approved', 'is_public', 'created'),
+            ('has_photo', 'is_approved', 'is_public', 'created'),
+        )
         permissions = (
             ("approve_recipe", "Can approve recipe"),
         )
 
+    def _get_counted_state(self):
+        return self.category_id, self.is_public and self.is_approved
+
+    @classmethod
+    def _remember_counted_state(cls, *args, **kwargs):
+        instance = kwargs.get('instance')
+        instance._counted_state = instance._get_counted_state() if instance.pk else None
+
+    @classmethod
+    def _bump_listing_counts(cls, *args, **kwargs):
+        schedule('recache_listing_counts')
+
+    @classmethod
+    def _bump_detail(cls, *args, **kwargs):
+        # cuisine.recipe_set changes send cuisine as instance
+        if kwargs.get('reverse'):
+            recipe_ids = kwargs.get('pk_set') or ()
+        else:
+            recipe_ids = (kwargs.get('instance').pk,)
+        for recipe_id in recipe_ids:
+            schedule('recache_recipe_detail', recipe_id)
+
+    @classmethod
+    def _update_recipes_counts(cls, *args, **kwargs):
+        """
+        keep category recipes counts up to date by applying +1/-1 \
+            on transitions of category, is_public and is_approved
+        """
+        instance = kwargs.get('instance')
+        if kwargs.get('signal') is models.signals.post_delete:
+            new_state = None
+        else:
+            new_state = instance._get_counted_state()
+
+        if kwargs.get('created'):
+            old_state = None
+        elif hasattr(instance, '_counted_state'):
+            old_state = instance._counted_state
+        else:
+            # unknown origin, e.g. instance with deferred fields
+            on_commit(Category.objects.invalidate_recipes_counts)
+            schedule('recache_recipe_ingredient_index', instance.pk)
+            schedule('recache_matching_recipe', instance.pk)
+            return
+
+        instance._counted_state = new_state
+        if old_state == new_state:
+            return
+
+        if bool(old_state and old_state[1]) != bool(new_state and new_state[1]):
+            schedule('recache_recipe_ingredient_index', instance.pk)
+            schedule('recache_matching_recipe', instance.pk)
+
+        # deltas are applied once the change is committed, each of them,
+        # so not by schedule() which would merge identical ones
+        if old_state and old_state[1]:
+            on_commit(partial(Category.objects.update_recipes_count, old_state[0], -1))
+        if new_state and new_state[1]:
+            on_commit(partial(Category.objects.update_recipes_count, new_state[0], 1))
+
     def get_photos(self, recache=False):
         cache_key = '%s_recipe_photos' % self.pk
         cached_photos = cache.get(cache_key)
         if cached_photos is None or recache:
-            cached_photos = []
             qs = self.recipephoto_set.visible().select_related('photo').order_by('order')
-            for one in qs:
-                if one.photo.owner_id == self.owner.pk:
-                    cached_photos.insert(0, one.photo)
-                else:
-                    cached_photos.append(one.photo)
+            cached_photos = self.arrange_photos(qs, self.owner_id)
             cache.set(cache_key, cached_photos)
 
         return cached_photos
 
+    @staticmethod
+    def arrange_photos(items, owner_id):
+        """
+        :param items: recipe's visible photos ordered by order
+        :type items: iterable of RecipePhoto
+        :param owner_id: recipe owner's pk, his photos go first
+        :type owner_id: int
+        :return: photos
+        :rtype: list
+        """
+        photos = []
+        for one in items:
+            if one.photo.owner_id == owner_id:
+                photos.insert(0, one.photo)
+            else:
+                photos.append(one.photo)
+        return photos
+
     def get_top_photo(self):
         """
         Get to photo for recipe. Prefer photo from recipe's owner, if available.
@@ -398,9 +541,8 @@ class Recipe(models.Model):
         :return: photo for recipe
         :rtype: Photo
         """
-        photos = self.get_photos()
-        if photos:
-            return photos[0]
+        if self.main_photo_id is not None:
+            return self.main_photo
         else:
             return self.category.photo_hierarchic
 
@@ -424,18 +566,27 @@ class Recipe(models.Model):
         cache_key = '%s_groupped_ingredients' % self.pk
         groups = cache.get(cache_key)
         if groups is None or recache:
-            qs = IngredientInRecipe.objects.filter(recipe=self).select_related('ingredient').order_by('group__order', 'order')
-
-            tmp_groups = {}
-            for one in qs:
-                group_index = one.group.title if one.group else '__nogroup__'
-                group_priority = one.group.order if one.group else 0
-                tmp_groups.setdefault(group_index, dict(items=[], priority=group_priority))['items'].append(one)
-
-            groups = sorted(tmp_groups.items(), key=lambda x: x[1].get('priority'))
+            qs = IngredientInRecipe.objects.filter(recipe=self).select_related('ingredient', 'group').order_by('group__order', 'order')
+            groups = self.group_ingredients(qs)
             cache.set(cache_key, groups)
         return groups
 
+    @staticmethod
+    def group_ingredients(items):
+        """
+        :param items: recipe's ingredients ordered by group order and order
+        :type items: iterable of IngredientInRecipe
+        :return: list of groups w/ items: (group, {prioriy:1, items:[]}
+        :rtype: list
+        """
+        tmp_groups = {}
+        for one in items:
+            group_index = one.group.title if one.group else '__nogroup__'
+            group_priority = one.group.order if one.group else 0
+            tmp_groups.setdefault(group_index, dict(items=[], priority=group_priority))['items'].append(one)
+
+        return sorted(tmp_groups.items(), key=lambda x: x[1].get('priority'))
+
     def get_absolute_url(self):
         return reverse('yummy:recipe_detail', args=(self.category.path, self.slug, self.pk,))
 
@@ -470,12 +621,10 @@ class RecipePhoto(models.Model):
     @classmethod
     def _bump_photos(cls, *args, **kwargs):
         recipe_id = kwargs.get('instance').recipe_id
-        try:
-            recipe = Recipe.objects.get(pk=recipe_id)
-        except Recipe.DoesNotExist:
-            pass
-        else:
-            recipe.get_photos(recache=True)
+        Recipe.objects.update_main_photos([recipe_id])
+        schedule('recache_recipe_photos', recipe_id)
+        schedule('recache_recipe_detail', recipe_id)
+        schedule('recache_listing_counts')
 
 
 class IngredientInRecipeGroup(models.Model):
@@ -497,6 +646,12 @@ class IngredientInRecipeGroup(models.Model):
             self.order = IngredientInRecipeGroup.objects.filter(recipe=self.recipe).count() + 1
         super(IngredientInRecipeGroup, self).save(*args, **kwargs)
 
+    @classmethod
+    def _bump_ingredients(cls, *args, **kwargs):
+        recipe_id = kwargs.get('instance').recipe_id
+        schedule('recache_recipe_ingredients', recipe_id)
+        schedule('recache_recipe_detail', recipe_id)
+
 
 class IngredientInRecipe(models.Model):
 
@@ -520,6 +675,26 @@ class IngredientInRecipe(models.Model):
             self.order = IngredientInRecipe.objects.filter(recipe=self.recipe).count() + 1
         super(IngredientInRecipe, self).save(*args, **kwargs)
 
+    @classmethod
+    def _remember_ingredient(cls, *args, **kwargs):
+        instance = kwargs.get('instance')
+        # deferred field is not loaded just for this
+        instance._indexed_ingredient_id = instance.__dict__.get('ingredient_id')
+
+    @classmethod
+    def _bump_ingredients(cls, *args, **kwargs):
+        instance = kwargs.get('instance')
+        schedule('recache_recipe_ingredients', instance.recipe_id)
+        schedule('recache_recipe_detail', instance.recipe_id)
+        schedule('recache_listing_counts')
+        schedule('recache_matching_recipe', instance.recipe_id)
+
+        # ingredient -> recipes index of both former and current ingredient
+        for ingredient_id in set([getattr(instance, '_indexed_ingredient_id', None), instance.ingredient_id]):
+            if ingredient_id is not None:
+                schedule('recache_ingredient_recipes', ingredient_id)
+        instance._indexed_ingredient_id = instance.ingredient_id
+
     @property
     def inflect_unit(self):
         def _get_magic_unit():
@@ -562,6 +737,10 @@ class UnitConversion(models.Model):
         verbose_name = _('Unit conversion')
         verbose_name_plural = _('Units conversions')
 
+    @classmethod
+    def _bump_conversions(cls, *args, **kwargs):
+        schedule('recache_unit_conversions')
+
 
 class RecipeRecommendation(models.Model):
 
@@ -596,6 +775,39 @@ class RecipeRecommendation(models.Model):
         super(RecipeRecommendation, self).save(*args, **kwargs)
 
 
+class RecipeRating(models.Model):
+    """
+    Precomputed rating of recipe. Score is bayesian average of votes, \
+    i.e. mean of votes pulled towards YUMMY_RATING_PRIOR_MEAN while \
+    recipe has few votes, see RecipeRatingManager.
+    """
+
+    objects = managers.RecipeRatingManager()
+
+    recipe = models.OneToOneField(Recipe, verbose_name=_('Recipe'), primary_key=True, related_name='rating')
+    votes_count = models.PositiveIntegerField(_('Votes count'), default=0)
+    votes_sum = models.PositiveIntegerField(_('Votes sum'), default=0)
+    score = models.FloatField(_('Score'), default=0, db_index=True, editable=False)
+
+    def __unicode__(self):
+        return u"%s: %.2f" % (self.recipe_id, self.score)
+
+    class Meta:
+        verbose_name = _("Recipe rating")
+        verbose_name_plural = _("Recipe ratings")
+
+    def save(self, *args, **kwargs):
+        self.score = RecipeRating.objects.compute_score(self.votes_count, self.votes_sum)
+        super(RecipeRating, self).save(*args, **kwargs)
+
+    @classmethod
+    def _create_for_recipe(cls, *args, **kwargs):
+        # raw saves (fixtures) too, recipe without rating would go first in
+        # descending ordering by score on databases sorting NULLs first
+        if kwargs.get('created'):
+            RecipeRating.objects.get_or_create(recipe_id=kwargs.get('instance').pk)
+
+
 class CookBookRecipe(models.Model):
 
     cookbook = CachedForeignKey('CookBook')
@@ -616,20 +828,13 @@ class CookBookRecipe(models.Model):
 
         ret_value = super(CookBookRecipe, self).save(*args, **kwargs)
 
-        self.cookbook.get_recipes_count(recache=True)
-        self.cookbook.__class__.objects.get_user_cookbook_items_for_recipe(self.cookbook.owner,
-                                                                           self.recipe,
-                                                                           recache=True)
+        schedule('recache_cookbook_recipes', self.cookbook_id, self.recipe_id)
         return ret_value
 
     def delete(self, *args, **kwargs):
-        cookbook = self.cookbook
-        recipe = self.recipe
+        cookbook_id, recipe_id = self.cookbook_id, self.recipe_id
         super(CookBookRecipe, self).delete(*args, **kwargs)
-        cookbook.get_recipes_count(recache=True)
-        cookbook.__class__.objects.get_user_cookbook_items_for_recipe(cookbook.owner,
-                                                                      recipe,
-                                                                      recache=True)
+        schedule('recache_cookbook_recipes', cookbook_id, recipe_id)
 
 
 class CookBook(models.Model):
@@ -704,6 +909,10 @@ class WeekMenu(models.Model):
     def __unicode__(self):
         return u"%s week, day %s" % (_("Even") if self.even_week else _("Odd"), self.get_day_display())
 
+    @classmethod
+    def _bump_menu(cls, *args, **kwargs):
+        schedule('recache_week_menu')
+
 
 class ShoppingList(models.Model):
 
@@ -736,5 +945,122 @@ class ShoppingListItem(models.Model):
         verbose_name_plural = _("Shopping list items")
 
 
+@recache_task
+def recache_category_tree():
+    invalidate_category_tree()
+    # moved categories change recipes listed in their ancestors
+    invalidate_listing_counts()
+
+
+@recache_task
+def recache_recipe_ingredients(recipe_id):
+    Recipe(pk=recipe_id).groupped_ingredients(recache=True)
+
+
+@recache_task
+def recache_recipe_photos(recipe_id):
+    try:
+        recipe = Recipe.objects.get(pk=recipe_id)
+    except Recipe.DoesNotExist:
+        pass
+    else:
+        recipe.get_photos(recache=True)
+
+
+@recache_task
+def recache_cookbook_recipes(cookbook_id, recipe_id):
+    try:
+        cookbook = CookBook.objects.select_related('owner').get(pk=cookbook_id)
+    except CookBook.DoesNotExist:
+        return
+    cookbook.get_recipes_count(recache=True)
+    CookBook.objects.get_user_recipes_count(cookbook.owner, recache=True)
+    CookBook.objects.get_user_cookbook_items_for_recipe(cookbook.owner, recipe_id, recache=True)
+
+
+@recache_task
+def recache_ingredient_recipes(ingredient_id):
+    Ingredient.objects.invalidate_recipe_index([ingredient_id])
+
+
+@recache_task
+def recache_recipe_ingredient_index(recipe_id):
+    ingredient_ids = IngredientInRecipe.objects.filter(recipe=recipe_id).order_by().\
+        values_list('ingredient', flat=True).distinct()
+    Ingredient.objects.invalidate_recipe_index(list(ingredient_ids))
+
+
+@recache_task
+def recache_matching_recipe(recipe_id):
+    record_change(MATCHING_RECIPE, recipe_id)
+
+
+@recache_task
+def recache_substitute_graph():
+    invalidate_substitute_graph()
+    record_change(MATCHING_SUBSTITUTES)
+
+
+@recache_task
+def recache_recipe_detail(recipe_id):
+    Recipe.objects.invalidate_detail(recipe_id)
+
+
+@recache_task
+def recache_listing_counts():
+    invalidate_listing_counts()
+
+
+@recache_task
+def recache_ingredient_groups(ingredient_id):
+    recipe_ids = IngredientInRecipe.objects.filter(ingredient=ingredient_id).order_by().\
+        values_list('recipe', flat=True).distinct()
+    cache.delete_many(['%s_groupped_ingredients' % pk for pk in recipe_ids])
+
+
+@recache_task
+def recache_ingredient_substitutes(ingredient_id):
+    cache.delete(SubstituteIngredient.objects.cache_manager_key('get_for_ingredient', Ingredient(pk=ingredient_id)))
+
+
+@recache_task
+def recache_ingredients():
+    bump_generation(INGREDIENTS)
+
+
+@recache_task
+def recache_week_menu():
+    bump_generation(WEEK_MENU)
+
+
+@recache_task
+def recache_unit_conversions():
+    invalidate_conversion_matrix()
+
+
+models.signals.post_delete.connect(Category._bump_tree, sender=Category)
+models.signals.post_init.connect(Recipe._remember_counted_state, sender=Recipe)
+models.signals.post_save.connect(Recipe._update_recipes_counts, sender=Recipe)
+models.signals.post_delete.connect(Recipe._update_recipes_counts, sender=Recipe)
+models.signals.post_save.connect(Recipe._bump_listing_counts, sender=Recipe)
+models.signals.post_delete.connect(Recipe._bump_listing_counts, sender=Recipe)
+models.signals.m2m_changed.connect(Recipe._bump_listing_counts, sender=Recipe.cuisines.through)
+models.signals.post_save.connect(Recipe._bump_detail, sender=Recipe)
+models.signals.post_delete.connect(Recipe._bump_detail, sender=Recipe)
+models.signals.m2m_changed.connect(Recipe._bump_detail, sender=Recipe.cuisines.through)
+models.signals.post_save.connect(RecipeRating._create_for_recipe, sender=Recipe)
+models.signals.post_save.connect(Ingredient._bump_ingredients, sender=Ingredient)
+models.signals.post_delete.connect(Ingredient._bump_ingredients, sender=Ingredient)
+models.signals.post_save.connect(WeekMenu._bump_menu, sender=WeekMenu)
+models.signals.post_delete.connect(WeekMenu._bump_menu, sender=WeekMenu)
+models.signals.post_save.connect(SubstituteIngredient._bump_substitutes, sender=SubstituteIngredient)
+models.signals.post_delete.connect(SubstituteIngredient._bump_substitutes, sender=SubstituteIngredient)
+models.signals.post_save.connect(UnitConversion._bump_conversions, sender=UnitConversion)
+models.signals.post_delete.connect(UnitConversion._bump_conversions, sender=UnitConversion)
 models.signals.post_save.connect(RecipePhoto._bump_photos, sender=RecipePhoto)
 models.signals.post_delete.connect(RecipePhoto._bump_photos, sender=RecipePhoto)
+models.signals.post_save.connect(IngredientInRecipeGroup._bump_ingredients, sender=IngredientInRecipeGroup)
+models.signals.post_delete.connect(IngredientInRecipeGroup._bump_ingredients, sender=IngredientInRecipeGroup)
+models.signals.post_init.connect(IngredientInRecipe._remember_ingredient, sender=IngredientInRecipe)
+models.signals.post_save.connect(IngredientInRecipe._bump_ingredients, sender=IngredientInRecipe)
+models.signals.post_delete.connect(IngredientInRecipe._bump_ingredients, sender=IngredientInRecipe)
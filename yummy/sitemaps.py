@@ -1,6 +1,11 @@
 from django.contrib.sitemaps import Sitemap
+from django.contrib.sitemaps import views as sitemap_views
+from django.views.decorators.http import condition
 
 from yummy.models import Recipe, Category, Ingredient
+from yummy.utils.cache import INGREDIENTS, get_generations, hash_key
+from yummy.utils.pagination import LISTING_COUNTS
+from yummy.utils.tree import CATEGORY_TREE
 
 class RecipeSitemap(Sitemap):
     changefreq = 'weekly'
@@ -27,3 +32,13 @@ class IngredientSitemap(Sitemap):
 
     def items(self):
         return Ingredient.objects.approved()
+
+
+def sitemap_etag(request, *args, **kwargs):
+    return hash_key([request.get_full_path()] + get_generations([LISTING_COUNTS, CATEGORY_TREE, INGREDIENTS]))
+
+
+# sitemap views answering conditional GET without building the sitemap, use them instead of
+# django.contrib.sitemaps.views in urls
+index = condition(etag_func=sitemap_etag)(sitemap_views.index)
+sitemap = condition(etag_func=sitemap_etag)(sitemap_views.sitemap)
@@ -2,7 +2,8 @@ from datetime import date
 from django import template
 from django.core.cache import cache
 
-from yummy.models import RecipeRecommendation, WeekMenu, Category, CookBookRecipe, CookBook
+from yummy.models import RecipeRecommendation, WeekMenu, CookBookRecipe, CookBook
+from yummy.utils.tree import get_category_tree
 from yummy import conf
 
 register = template.Library()
@@ -84,21 +85,12 @@ class CategoriesNode(template.Node):
         self.category, self.varname = category, varname
 
     def render(self, context):
+        tree = get_category_tree()
         if self.category is not None:
             c = template.Variable(self.category).resolve(context)
-            qs = Category.objects.filter(parent=c)
-            pk = c.pk
+            context[self.varname] = tree.children(c.pk)
         else:
-            qs = Category.objects.filter(parent__isnull=True)
-            pk = 0
-
-        key = 'yummy_get_categories:%d' % pk
-        c = cache.get(key)
-        if c is None:
-            c = list(qs)
-            cache.set(key, c, conf.CACHE_TIMEOUT_LONG)
-
-        context[self.varname] = c
+            context[self.varname] = tree.roots()
         return ''
 
 
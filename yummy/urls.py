@@ -6,7 +6,7 @@ from django.template.defaultfilters import slugify
 from yummy.views import (
     CategoryView, IngredientView, RecipeDetail, CategoryReorder, DailyMenu,
     AuthorRecipes, AuthorList, IngredientGroupView, IngredientDetail,
-    CuisineView, CategoryDetail, FavoriteRecipeAdd, CookBookList,
+    IngredientMatch, IngredientAutocomplete, CuisineView, CategoryDetail, FavoriteRecipeAdd, CookBookList,
     CookBookDetail, CookBookAdd, CookBookEdit, CookBookRemove,
     FavoriteRecipeRemove, CookBookPrint, FavoriteRecipeEdit, ShoppingListView, ShoppingListDetailView)
 
@@ -22,6 +22,8 @@ urlpatterns = patterns('',
     url(r'^%s/$' % slugify(_("cooks")), AuthorList.as_view(), name='authors_list'),
 
     url(r'^%s/detail/(?P<ingredient>[\w-]+)/$' % INGREDIENT, IngredientDetail.as_view(), name='ingredient_detail'),
+    url(r'^%s/match/$' % INGREDIENT, IngredientMatch.as_view(), name='ingredient_match'),
+    url(r'^%s/autocomplete/$' % INGREDIENT, IngredientAutocomplete.as_view(), name='ingredient_autocomplete'),
     url(r'^%s/group/(?P<group>[\w-]+)/$' % INGREDIENT, IngredientGroupView.as_view(), name='ingredient_group'),
     # url(r'^%s/season/(?P<ingredient>[\w-]+)/$' % INGREDIENT, IngredientView.as_view(), name='ingredient_season'), #TODO
     url(r'^%s/$' % INGREDIENT, IngredientView.as_view(), name='ingredient_index'),
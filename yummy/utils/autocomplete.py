@@ -0,0 +1,121 @@
+"""
+Autocomplete of ingredient names.
+
+Names of approved ingredients are folded (lowercase, no accents) and kept
+sorted, so all names starting with typed prefix form single slice found
+by bisect. Index is built once per generation of ingredients, held per
+process and shared via cache.
+"""
+from bisect import bisect_left
+from unicodedata import category, normalize
+
+from django.core.cache import cache
+from django.utils.encoding import force_text
+
+from yummy import conf
+from yummy.utils import get_model
+from yummy.utils.cache import INGREDIENTS, get_generation
+
+_local_index = None
+
+
+def fold(text):
+    """
+    :param text: text to fold
+    :return: lowercase text without accents, e.g. u'Cesnek' for u'\\u010cesnek'
+    :rtype: unicode
+    """
+    text = normalize('NFKD', force_text(text).lower())
+    return u''.join(char for char in text if category(char) != 'Mn')
+
+
+class IngredientIndex(object):
+
+    def __init__(self, ingredients, generation=None):
+        """
+        :param ingredients: (pk, name, slug) of indexed ingredients
+        :type ingredients: iterable
+        """
+        self.generation = generation
+
+        # whole names, then words inside of names, so "oil" finds "olive oil" too
+        self._names = []
+        self._words = []
+        for pk, name, slug in ingredients:
+            item = (pk, name, slug)
+            folded = fold(name)
+            self._names.append((folded, item))
+            start = folded.find(u' ')
+            while start != -1:
+                self._words.append((folded[start + 1:], item))
+                start = folded.find(u' ', start + 1)
+        self._names.sort()
+        self._words.sort()
+
+    def __len__(self):
+        return len(self._names)
+
+    def names(self):
+        """all names, alphabetically"""
+        return [item[1] for folded, item in self._names]
+
+    def _starting_with(self, entries, prefix):
+        index = bisect_left(entries, (prefix,))
+        while index < len(entries) and entries[index][0].startswith(prefix):
+            yield entries[index][1]
+            index += 1
+
+    def search(self, prefix, limit=None):
+        """
+        Ingredients with name or some word of name starting with prefix,
+        whole name matches first, each group alphabetically.
+
+        :param prefix: typed text, case and accents are ignored
+        :type prefix: unicode
+        :param limit: maximal number of results
+        :type limit: int
+        :return: (pk, name, slug) of found ingredients
+        :rtype: list
+        """
+        prefix = fold(prefix).strip()
+        if not prefix:
+            return []
+
+        found = []
+        seen = set()
+        for entries in (self._names, self._words):
+            for item in self._starting_with(entries, prefix):
+                if limit is not None and len(found) >= limit:
+                    return found
+                if item[0] not in seen:
+                    seen.add(item[0])
+                    found.append(item)
+        return found
+
+
+def _index_cache_key(generation):
+    return '%s:ingredient_index:%s' % (conf.CACHE_PREFIX, generation)
+
+
+def get_ingredient_index(recache=False):
+    """
+    Index of current generation of ingredients, rebuilt once per change
+    of ingredients, bulk changes are coalesced to single generation bump.
+
+    :param recache: rebuild from database and replace cached index
+    :type recache: bool
+    :rtype: IngredientIndex
+    """
+    global _local_index
+
+    generation = get_generation(INGREDIENTS)
+    index = _local_index
+    if recache or index is None or index.generation != generation:
+        key = _index_cache_key(generation)
+        index = None if recache else cache.get(key)
+        if index is None:
+            qs = get_model('yummy', 'ingredient').objects.approved().values_list('pk', 'name', 'slug')
+            index = IngredientIndex(qs.iterator(), generation)
+            cache.set(key, index, conf.CACHE_TIMEOUT_LONG)
+        _local_index = index
+    return index
@@ -1,8 +1,16 @@
+from hashlib import md5
+from time import time
+
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
+from django.utils.encoding import smart_str
 
 from yummy import conf
 
+# generations of data sets invalidated as a whole
+WEEK_MENU = 'week_menu'
+INGREDIENTS = 'ingredients'
+
 
 def get_cached_model(model, pk, timeout=conf.CACHE_TIMEOUT):
     if not isinstance(model, ContentType):
@@ -18,3 +26,71 @@ def get_cached_model(model, pk, timeout=conf.CACHE_TIMEOUT):
         cache.set(key, obj, timeout)
     return obj
 
+
+def _generation_key(name):
+    return "%s:generation:%s" % (conf.CACHE_PREFIX, name)
+
+
+def _new_generation():
+    # time based, so a generation lost from cache is never reissued
+    return int(time() * 1000)
+
+
+def get_generation(name):
+    """
+    current generation number of data stored under given name, \\
+        data cached under older generations are considered stale
+
+    :param name: name of cached data set
+    :type name: str
+    :return: generation number
+    :rtype: int
+    """
+    return get_generations([name])[0]
+
+
+def get_generations(names):
+    """
+    current generation numbers of given data sets by single cache round-trip
+
+    :param names: names of cached data sets
+    :type names: list
+    :return: generation numbers in order of names
+    :rtype: list
+    """
+    keys = [_generation_key(name) for name in names]
+    generations = cache.get_many(keys)
+
+    missing = dict((key, _new_generation()) for key in keys if generations.get(key) is None)
+    if missing:
+        cache.set_many(missing, None)
+        generations.update(missing)
+    return [generations[key] for key in keys]
+
+
+def hash_key(parts):
+    """
+    :param parts: values identifying cached item
+    :type parts: iterable
+    :return: short hash usable in cache keys and etags
+    :rtype: str
+    """
+    return md5(smart_str(u':'.join(map(unicode, parts)))).hexdigest()
+
+
+def bump_generation(name):
+    """
+    invalidate all data cached under current generation of given name
+
+    :param name: name of cached data set
+    :type name: str
+    :return: new generation number
+    :rtype: int
+    """
+    key = _generation_key(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        generation = _new_generation()
+        cache.set(key, generation, None)
+        return generation
@@ -0,0 +1,243 @@
+"""
+"Cook with what I have" - matching recipes to ingredients user has.
+
+Incidence of public recipes and their ingredients is held in memory of
+each process as sorted integer arrays, ingredient -> recipes and recipe ->
+ingredients, so matching touches only recipes of the requested ingredients.
+
+Changes of recipes are recorded to a log in cache after commit, every
+process applies them to its matcher on next use. Matcher is rebuilt from
+database if the log is too long or some of its entries are lost.
+
+Without real cache (DummyCache) there is no log to follow, each call then
+builds matcher of just the recipes using requested ingredients instead.
+"""
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import groupby
+from operator import itemgetter
+from threading import Lock
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+
+from yummy import conf
+from yummy.utils import get_model
+from yummy.utils.cache import get_generation, bump_generation
+from yummy.utils.substitutes import get_substitute_graph
+
+# generation counter serves as position in change log
+MATCHING = 'matching'
+
+RECIPE = 'recipe'
+SUBSTITUTES = 'substitutes'
+
+Match = namedtuple('Match', ('recipe_id', 'matched', 'missing'))
+
+_local_matcher = None
+_lock = Lock()
+
+
+class IngredientMatcher(object):
+
+    def __init__(self, seq=None):
+        self.seq = seq
+        # recipe id -> sorted array of its ingredient ids
+        self._ingredients = {}
+        # ingredient id -> sorted array of ids of recipes using it
+        self._recipes = {}
+        # substitute id -> ingredients it can replace
+        self._replaces = {}
+
+    def __len__(self):
+        return len(self._ingredients)
+
+    def set_recipe(self, recipe_id, ingredient_ids):
+        """
+        :param recipe_id: pk of recipe
+        :type recipe_id: int
+        :param ingredient_ids: pks of recipe's ingredients, empty to remove the recipe
+        :type ingredient_ids: iterable
+        """
+        self.remove_recipe(recipe_id)
+        ingredient_ids = sorted(set(ingredient_ids))
+        if not ingredient_ids:
+            return
+
+        self._ingredients[recipe_id] = array('l', ingredient_ids)
+        for one in ingredient_ids:
+            recipes = self._recipes.setdefault(one, array('l'))
+            recipes.insert(bisect_left(recipes, recipe_id), recipe_id)
+
+    def remove_recipe(self, recipe_id):
+        for one in self._ingredients.pop(recipe_id, ()):
+            recipes = self._recipes[one]
+            index = bisect_left(recipes, recipe_id)
+            if index < len(recipes) and recipes[index] == recipe_id:
+                del recipes[index]
+            if not recipes:
+                del self._recipes[one]
+
+    def set_substitutes(self, pairs):
+        """
+        :param pairs: (ingredient id, id of its substitute) pairs
+        :type pairs: iterable
+        """
+        self._replaces = {}
+        for ingredient_id, substitute_id in pairs:
+            self._replaces.setdefault(substitute_id, set()).add(ingredient_id)
+
+    def covered(self, ingredient_ids, substitutes=False):
+        """
+        :return: given ingredients and, with `substitutes`, ones they can replace
+        :rtype: set
+        """
+        covered = set(ingredient_ids)
+        if substitutes:
+            for one in list(covered):
+                covered.update(self._replaces.get(one, ()))
+        return covered
+
+    def match(self, ingredient_ids, min_matched=1, max_missing=None, substitutes=False, limit=None):
+        """
+        Recipes using at least `min_matched` of given ingredients and missing
+        at most `max_missing` of their ingredients, ones missing less first.
+
+        :param ingredient_ids: pks of ingredients user has
+        :type ingredient_ids: iterable
+        :param min_matched: minimal number of matched recipe ingredients
+        :type min_matched: int
+        :param max_missing: maximal number of missing recipe ingredients, None for any
+        :type max_missing: int
+        :param substitutes: count ingredients replaceable by user's ones as matched
+        :type substitutes: bool
+        :param limit: maximal number of matches
+        :type limit: int
+        :return: matches
+        :rtype: list of Match
+        """
+        hits = {}
+        for one in self.covered(ingredient_ids, substitutes):
+            for recipe_id in self._recipes.get(one, ()):
+                hits[recipe_id] = hits.get(recipe_id, 0) + 1
+
+        min_matched = max(min_matched, 1)
+        matches = []
+        for recipe_id, matched in hits.iteritems():
+            missing = len(self._ingredients.get(recipe_id, ())) - matched
+            if matched >= min_matched and (max_missing is None or missing <= max_missing):
+                matches.append(Match(recipe_id, matched, missing))
+
+        matches.sort(key=lambda one: (one.missing, -one.matched, -one.recipe_id))
+        return matches[:limit] if limit is not None else matches
+
+
+def _change_key(seq):
+    return '%s:matching:change:%s' % (conf.CACHE_PREFIX, seq)
+
+
+def _get_rows(recipe_ids=None):
+    qs = get_model('yummy', 'ingredientinrecipe').objects.filter(recipe__is_approved=True, recipe__is_public=True)
+    if recipe_ids is not None:
+        qs = qs.filter(recipe__in=recipe_ids)
+    return qs.order_by('recipe').values_list('recipe', 'ingredient')
+
+
+def _get_substitutes():
+    return get_substitute_graph().pairs()
+
+
+def build_matcher(seq=None, ingredient_ids=None, substitutes=True):
+    """
+    :param seq: position in change log the matcher is built at
+    :type seq: int
+    :param ingredient_ids: load only recipes using some of these ingredients, all if None
+    :type ingredient_ids: iterable
+    :param substitutes: load substitutes
+    :type substitutes: bool
+    :rtype: IngredientMatcher
+    """
+    matcher = IngredientMatcher(seq)
+    if substitutes:
+        matcher.set_substitutes(_get_substitutes())
+
+    recipe_ids = None
+    if ingredient_ids is not None:
+        recipe_ids = get_model('yummy', 'ingredientinrecipe').objects.\
+            filter(ingredient__in=matcher.covered(ingredient_ids, substitutes)).values('recipe')
+    for recipe_id, rows in groupby(_get_rows(recipe_ids).iterator(), itemgetter(0)):
+        matcher.set_recipe(recipe_id, [one[1] for one in rows])
+    return matcher
+
+
+def _apply_changes(matcher, changes):
+    recipe_ids = set(pk for kind, pk in changes if kind == RECIPE)
+    if recipe_ids:
+        rows = dict((recipe_id, [one[1] for one in group]) for recipe_id, group in groupby(_get_rows(recipe_ids), itemgetter(0)))
+        for recipe_id in recipe_ids:
+            matcher.set_recipe(recipe_id, rows.get(recipe_id, ()))
+
+    if any(kind == SUBSTITUTES for kind, pk in changes):
+        matcher.set_substitutes(_get_substitutes())
+
+
+def _has_change_log():
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], DummyCache)
+
+
+def _get_matcher(seq):
+    """
+    Matcher of this process with all recorded changes applied, call with
+    the lock held, changes are applied in place.
+
+    :param seq: current position in change log
+    :type seq: int
+    :rtype: IngredientMatcher
+    """
+    global _local_matcher
+
+    matcher = _local_matcher
+    if matcher is not None and matcher.seq < seq <= matcher.seq + conf.MATCHING_MAX_CHANGES:
+        keys = [_change_key(one) for one in range(matcher.seq + 1, seq + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) == len(keys):
+            _apply_changes(matcher, changes.values())
+            matcher.seq = seq
+        else:
+            matcher = None
+
+    if matcher is None or matcher.seq != seq:
+        matcher = build_matcher(seq)
+    _local_matcher = matcher
+    return matcher
+
+
+def match(ingredient_ids, min_matched=1, max_missing=None, substitutes=False, limit=None):
+    """
+    Match recipes by matcher of this process, see IngredientMatcher.match.
+    Matching holds the lock, so no other thread applies changes meanwhile.
+
+    :rtype: list of Match
+    """
+    if not _has_change_log():
+        matcher = build_matcher(ingredient_ids=ingredient_ids, substitutes=substitutes)
+        return matcher.match(ingredient_ids, min_matched, max_missing, substitutes, limit)
+
+    seq = get_generation(MATCHING)
+    with _lock:
+        return _get_matcher(seq).match(ingredient_ids, min_matched, max_missing, substitutes, limit)
+
+
+def record_change(kind, pk=None):
+    """
+    Log change for matchers of all processes, call after commit.
+
+    :param kind: RECIPE or SUBSTITUTES
+    :type kind: str
+    :param pk: pk of changed recipe
+    :type pk: int
+    """
+    # if the counter was lost, new one starts far ahead and all matchers get rebuilt
+    seq = bump_generation(MATCHING)
+    cache.set(_change_key(seq), (kind, pk), conf.CACHE_TIMEOUT_LONG)
@@ -0,0 +1,248 @@
+"""
+Pagination helpers for recipe listings.
+
+Keyset (seek) pagination addresses pages by opaque cursor holding ordering
+value and id of the boundary recipe instead of page number, so database
+seeks right to the page via index and page cost doesn't grow with depth
+of the page.
+
+Listing counts are cached per listing until any recipe changes, counts of
+big listings may be estimated from database statistics.
+"""
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from json import dumps, loads
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+
+from yummy import conf
+from yummy.utils.cache import get_generation, bump_generation, hash_key
+
+# bumped on any change of listed recipes
+LISTING_COUNTS = 'listing_counts'
+
+# ordering attribute: (field, descending)
+KEYSET_ORDERINGS = {
+    '-created': ('created', True),
+    'title': ('title', False),
+}
+
+FORWARD = 'n'
+BACKWARD = 'p'
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(value, pk, direction=FORWARD):
+    # full isoformat, json encoder of django would cut off microseconds
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    data = dumps([value, pk, direction], separators=(',', ':'))
+    return urlsafe_b64encode(data.encode('utf-8')).rstrip('=')
+
+
+def decode_cursor(cursor, field):
+    """
+    :param cursor: cursor created by ``encode_cursor``
+    :type cursor: str
+    :param field: model field the cursor value belongs to
+    :return: value, pk and direction
+    :rtype: tuple
+    """
+    try:
+        cursor = str(cursor)
+        data = loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+        value, pk, direction = data
+        value = field.to_python(value)
+        pk = int(pk)
+    except (TypeError, ValueError, UnicodeError, ValidationError):
+        raise InvalidCursor(cursor)
+
+    if value is None or direction not in (FORWARD, BACKWARD):
+        raise InvalidCursor(cursor)
+    return value, pk, direction
+
+
+class KeysetPage(object):
+
+    number = None
+
+    def __init__(self, object_list, attname, next_item=None, previous_item=None):
+        self.object_list = object_list
+        self.attname = attname
+        self.next_cursor = self._cursor(next_item, FORWARD)
+        self.previous_cursor = self._cursor(previous_item, BACKWARD)
+
+    def _cursor(self, item, direction):
+        if item is None:
+            return None
+        return encode_cursor(getattr(item, self.attname), item.pk, direction)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def paginate_keyset(queryset, order_attr, per_page, cursor=None):
+    """
+    Fetch single page of queryset ordered by given ordering attribute.
+
+    :param queryset: queryset to paginate, it's ordering is replaced
+    :param order_attr: key of ``KEYSET_ORDERINGS``
+    :type order_attr: str
+    :param per_page: number of items on page
+    :type per_page: int
+    :param cursor: cursor of requested page, first page if not given
+    :type cursor: str
+    :return: page
+    :rtype: KeysetPage
+    """
+    name, descending = KEYSET_ORDERINGS[order_attr]
+    field = queryset.model._meta.get_field(name)
+
+    value = pk = None
+    direction = FORWARD
+    if cursor:
+        value, pk, direction = decode_cursor(cursor, field)
+
+    # walking backward means walking the opposite ordering and flipping the page
+    reverse = descending != (direction == BACKWARD)
+    lookup = 'lt' if reverse else 'gt'
+    prefix = '-' if reverse else ''
+
+    qs = queryset.order_by('%s%s' % (prefix, name), '%spk' % prefix)
+    if cursor:
+        qs = qs.filter(
+            Q(**{'%s__%s' % (name, lookup): value}) |
+            Q(**{name: value, 'pk__%s' % lookup: pk})
+        )
+
+    items = list(qs[:per_page + 1])
+    has_more = len(items) > per_page
+    items = items[:per_page]
+
+    if direction == FORWARD:
+        more_after, more_before = has_more, bool(cursor)
+    else:
+        items.reverse()
+        more_after, more_before = True, has_more
+
+    return KeysetPage(
+        items,
+        field.attname,
+        next_item=items[-1] if items and more_after else None,
+        previous_item=items[0] if items and more_before else None,
+    )
+
+
+class ObjectsByIds(object):
+    """
+    Sequence of objects given by ordered ids, e.g. from cached index.
+    Paginator counts it by ids, objects are fetched only for the page.
+
+    Index may hold only leading part of the sequence, then `count` gives
+    its full length and `rest` is queryset of all objects in the same
+    order, pages reaching past the ids are sliced from it.
+    """
+
+    def __init__(self, ids, queryset, count=None, rest=None):
+        self.ids = ids
+        self.queryset = queryset
+        self.count = len(ids) if count is None or rest is None else count
+        self.rest = rest
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if self.rest is not None and (index.stop is None or index.stop > len(self.ids)):
+            return list(self.rest[index])
+        ids = self.ids[index]
+        objects = self.queryset.in_bulk(ids)
+        return [objects[pk] for pk in ids if pk in objects]
+
+
+class CountedPaginator(Paginator):
+    """paginator taking count of objects from given function"""
+
+    def __init__(self, object_list, per_page, count_func=None, **kwargs):
+        super(CountedPaginator, self).__init__(object_list, per_page, **kwargs)
+        self.count_func = count_func
+
+    def _get_count(self):
+        if self._count is None and self.count_func is not None:
+            self._count = self.count_func()
+        return super(CountedPaginator, self)._get_count()
+    count = property(_get_count)
+
+
+def estimate_count(queryset):
+    """
+    Number of rows planner expects queryset to return, read from EXPLAIN.
+    Supported on PostgreSQL only.
+
+    :return: estimated count or None if not available
+    :rtype: int
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    sql, params = queryset.query.sql_with_params()
+    cursor = connection.cursor()
+    try:
+        cursor.execute('EXPLAIN (FORMAT JSON) %s' % sql, params)
+        plan = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    if not isinstance(plan, list):
+        plan = loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def get_listing_count(queryset, key, estimate=False):
+    """
+    Count of listed objects, cached until any recipe changes.
+
+    :param queryset: listed objects
+    :param key: parts identifying the listing, e.g. view, cynosure and filters
+    :type key: tuple
+    :param estimate: allow estimate if listing is bigger than YUMMY_LISTING_COUNT_ESTIMATE_FROM
+    :type estimate: bool
+    :return: count
+    :rtype: int
+    """
+    key = '%s:%s:%s:%s' % (conf.CACHE_PREFIX, LISTING_COUNTS, get_generation(LISTING_COUNTS), hash_key(key))
+
+    count = cache.get(key)
+    if count is None:
+        if estimate and conf.LISTING_COUNT_ESTIMATE_FROM is not None:
+            count = estimate_count(queryset)
+            if count is not None and count < conf.LISTING_COUNT_ESTIMATE_FROM:
+                count = None
+        if count is None:
+            count = queryset.count()
+        cache.set(key, count, conf.CACHE_TIMEOUT_LONG)
+    return count
+
+
+def invalidate_listing_counts():
+    bump_generation(LISTING_COUNTS)
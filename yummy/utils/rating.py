@@ -0,0 +1,10 @@
+def order_by_rating(qs):
+    """
+    Default YUMMY_FUNC_QS_BY_RATING, orders recipes by indexed precomputed
+    score of RecipeRating. Every recipe is expected to have its rating,
+    run yummy_refresh_ratings after bulk_create of recipes.
+
+    :param qs: recipes
+    :return: recipes, best rated first
+    """
+    return qs.order_by('-rating__score', '-created')
@@ -0,0 +1,85 @@
+"""
+Cache rebuilds triggered by saving yummy models.
+
+Rebuilds requested within a transaction are collected, deduplicated and run
+once after the transaction commits. Set ``YUMMY_RECACHE_HANDLER`` to hand
+them off to a background worker, the handler is called with task name and
+arguments, worker is expected to call ``run_task`` with them.
+"""
+import weakref
+from threading import local
+
+from django.db import transaction
+
+from yummy import conf
+from yummy.utils import import_module_member
+
+_tasks = {}
+_state = local()
+
+
+def recache_task(func):
+    """register function as a rebuild task named after the function"""
+    _tasks[func.__name__] = func
+    return func
+
+
+def run_task(name, *args):
+    _tasks[name](*args)
+
+
+def get_handler():
+    if conf.RECACHE_HANDLER:
+        return import_module_member(conf.RECACHE_HANDLER)
+    return run_task
+
+
+def on_commit(func):
+    """run func after current transaction commits, right away outside of transaction"""
+    # django < 1.9 has no hooks, run right away
+    hook = getattr(transaction, 'on_commit', None)
+    if hook is None:
+        func()
+    else:
+        hook(func)
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.items = []
+        self.seen = set()
+        self.done = False
+
+    def add(self, item):
+        if item not in self.seen:
+            self.seen.add(item)
+            self.items.append(item)
+
+    def flush(self):
+        self.done = True
+        handler = get_handler()
+        for name, args in self.items:
+            handler(name, *args)
+
+
+def schedule(name, *args):
+    """
+    Request rebuild, it's run once after current transaction commits or
+    right away outside of transaction.
+
+    :param name: registered task name
+    :type name: str
+    """
+    # only the pending commit hook holds the batch, so the weak reference
+    # dies with the hook when transaction is rolled back
+    batch = getattr(_state, 'batch', None)
+    batch = batch() if batch is not None else None
+
+    if batch is None or batch.done:
+        batch = _Batch()
+        batch.add((name, args))
+        _state.batch = weakref.ref(batch)
+        on_commit(batch.flush)
+    else:
+        batch.add((name, args))
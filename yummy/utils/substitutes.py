@@ -0,0 +1,137 @@
+"""
+Graph of substitute ingredients.
+
+Substitutes of substitutes are substitutes too, nearer ones are better.
+Transitive closure of all ``SubstituteIngredient`` pairs up to
+``YUMMY_SUBSTITUTES_MAX_DEPTH`` steps is computed from single query once
+per change of any substitute, held per process and shared via cache.
+"""
+from array import array
+
+from django.core.cache import cache
+
+from yummy import conf
+from yummy.utils import get_model
+from yummy.utils.cache import get_generation, bump_generation
+
+SUBSTITUTE_GRAPH = 'substitute_graph'
+
+_local_graph = None
+
+
+def _closure(edges, max_depth):
+    """
+    :param edges: node -> directly reachable nodes
+    :type edges: dict
+    :return: node -> (reached nodes nearest first, their depths, ends of depth levels)
+    :rtype: dict
+    """
+    closure = {}
+    for start in edges:
+        seen = set([start])
+        level = [start]
+        reached, depths, ends = array('l'), array('b'), []
+        while level and len(ends) < max_depth:
+            level = sorted(set(one for node in level for one in edges.get(node, ()) if one not in seen))
+            seen.update(level)
+            reached.extend(level)
+            depths.extend([len(ends) + 1] * len(level))
+            ends.append(len(reached))
+        closure[start] = (reached, depths, ends)
+    return closure
+
+
+class SubstituteGraph(object):
+    """
+    Snapshot of substitutes of all ingredients, ids only. Lookups return
+    (ingredient id, depth) pairs, depth is the number of substitution steps.
+    """
+
+    def __init__(self, pairs, max_depth, generation=None):
+        """
+        :param pairs: (ingredient id, id of its substitute) pairs
+        :type pairs: iterable
+        :param max_depth: maximal number of substitution steps
+        :type max_depth: int
+        """
+        self.generation = generation
+        self.max_depth = max_depth
+
+        substitutes, replaces = {}, {}
+        for ingredient_id, substitute_id in pairs:
+            substitutes.setdefault(ingredient_id, set()).add(substitute_id)
+            replaces.setdefault(substitute_id, set()).add(ingredient_id)
+        self._substitutes = _closure(substitutes, max_depth)
+        self._replaces = _closure(replaces, max_depth)
+
+    def __len__(self):
+        return len(self._substitutes)
+
+    def _lookup(self, closure, pk, depth):
+        if pk not in closure or (depth is not None and depth < 1):
+            return []
+        reached, depths, ends = closure[pk]
+        end = ends[depth - 1] if depth is not None and depth <= len(ends) else len(reached)
+        return zip(reached[:end], depths[:end])
+
+    def substitutes(self, pk, depth=None):
+        """
+        :param pk: pk of ingredient
+        :type pk: int
+        :param depth: maximal number of substitution steps, all up to max_depth if None
+        :type depth: int
+        :return: (id, depth) of ingredients usable instead of given one, nearest first
+        :rtype: list
+        """
+        return self._lookup(self._substitutes, pk, depth)
+
+    def replaces(self, pk, depth=None):
+        """
+        :return: (id, depth) of ingredients given one can be used instead of, nearest first
+        :rtype: list
+        """
+        return self._lookup(self._replaces, pk, depth)
+
+    def pairs(self, depth=None):
+        """
+        :return: (ingredient id, substitute id) pairs of the closure
+        :rtype: list
+        """
+        return [
+            (pk, substitute_id)
+            for pk in self._substitutes
+            for substitute_id, substitute_depth in self.substitutes(pk, depth)
+        ]
+
+
+def _graph_cache_key(generation):
+    return '%s:%s:%s' % (conf.CACHE_PREFIX, SUBSTITUTE_GRAPH, generation)
+
+
+def get_substitute_graph():
+    """
+    Substitute graph of current generation, built only once per change
+    of any substitute.
+
+    :rtype: SubstituteGraph
+    """
+    global _local_graph
+
+    generation = get_generation(SUBSTITUTE_GRAPH)
+    graph = _local_graph
+    if graph is None or graph.generation != generation:
+        key = _graph_cache_key(generation)
+        graph = cache.get(key)
+        if graph is None or graph.max_depth != conf.SUBSTITUTES_MAX_DEPTH:
+            pairs = get_model('yummy', 'substituteingredient').objects.values_list('ingredient', 'substitute')
+            graph = SubstituteGraph(pairs.iterator(), conf.SUBSTITUTES_MAX_DEPTH, generation)
+            cache.set(key, graph, conf.CACHE_TIMEOUT_LONG)
+        _local_graph = graph
+    return graph
+
+
+def invalidate_substitute_graph():
+    global _local_graph
+
+    _local_graph = None
+    bump_generation(SUBSTITUTE_GRAPH)
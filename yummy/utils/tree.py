@@ -0,0 +1,125 @@
+from django.core.cache import cache
+
+from yummy import conf
+from yummy.utils import get_model
+from yummy.utils.cache import get_generation, bump_generation
+
+CATEGORY_TREE = 'category_tree'
+
+_local_tree = None
+
+
+class CategoryTree(object):
+    """
+    Snapshot of the whole category tree built from single query. All lookups
+    are answered from memory, categories are shared between lookups, so do
+    not modify them.
+    """
+
+    def __init__(self, categories, generation=None):
+        self.generation = generation
+        self._by_pk = {}
+        self._by_path = {}
+        self._children = {}
+        self._ancestors = {}
+
+        # categories are ordered by path, so parents always precede children
+        for category in categories:
+            self._by_pk[category.pk] = category
+            self._by_path[category.path] = category
+            self._children.setdefault(category.parent_id, []).append(category.pk)
+
+            parent_id = category.parent_id
+            if parent_id in self._by_pk:
+                self._ancestors[category.pk] = self._ancestors[parent_id] + (parent_id,)
+                setattr(category, category._meta.get_field('parent').get_cache_name(), self._by_pk[parent_id])
+            else:
+                self._ancestors[category.pk] = ()
+
+    def __contains__(self, pk):
+        return pk in self._by_pk
+
+    def __len__(self):
+        return len(self._by_pk)
+
+    def pks(self):
+        return list(self._by_pk)
+
+    def get(self, pk):
+        return self._by_pk.get(pk)
+
+    def get_by_path(self, path):
+        return self._by_path.get(path)
+
+    def parent(self, pk):
+        ancestors = self._ancestors.get(pk)
+        return self._by_pk[ancestors[-1]] if ancestors else None
+
+    def roots(self):
+        return self.children(None)
+
+    def children(self, pk):
+        return [self._by_pk[one] for one in self._children.get(pk, ())]
+
+    def ancestor_pks(self, pk):
+        return self._ancestors.get(pk, ())
+
+    def ancestors(self, pk):
+        """ancestors of given category, root first"""
+        return [self._by_pk[one] for one in self.ancestor_pks(pk)]
+
+    def lineage(self, pk):
+        """ancestors of given category followed by the category itself"""
+        if pk not in self._by_pk:
+            return []
+        return self.ancestors(pk) + [self._by_pk[pk]]
+
+    def root(self, pk):
+        ancestors = self._ancestors.get(pk)
+        if ancestors is None:
+            return None
+        return self._by_pk[ancestors[0] if ancestors else pk]
+
+    def descendants(self, pk):
+        """descendants of given category, depth first"""
+        cats = []
+        stack = list(reversed(self._children.get(pk, ())))
+        while stack:
+            one = stack.pop()
+            cats.append(self._by_pk[one])
+            stack.extend(reversed(self._children.get(one, ())))
+        return cats
+
+
+def _tree_cache_key(generation):
+    return '%s:%s:%s' % (conf.CACHE_PREFIX, CATEGORY_TREE, generation)
+
+
+def get_category_tree():
+    """
+    Category tree of current generation. Tree is held per process and
+    shared via cache, so it's built only once per change of any category.
+
+    :return: category tree snapshot
+    :rtype: CategoryTree
+    """
+    global _local_tree
+
+    generation = get_generation(CATEGORY_TREE)
+    tree = _local_tree
+    if tree is None or tree.generation != generation:
+        key = _tree_cache_key(generation)
+        tree = cache.get(key)
+        if tree is None:
+            qs = get_model('yummy', 'category').objects.select_related(None).select_related('photo')
+            tree = CategoryTree(qs.order_by('path'), generation)
+            cache.set(key, tree, conf.CACHE_TIMEOUT_LONG)
+        _local_tree = tree
+    return tree
+
+
+def invalidate_category_tree():
+    global _local_tree
+
+    _local_tree = None
+    bump_generation(CATEGORY_TREE)
@@ -0,0 +1,142 @@
+"""
+Conversion of ingredient amounts between units.
+
+``UnitConversion`` rows and their inverses are closed transitively into
+matrix of ratios between all units of ``conf.UNITS`` once per change of
+any conversion, so converting amount is single lookup. Matrix is held per
+process and shared via cache.
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+
+from yummy import conf
+from yummy.utils import get_model
+from yummy.utils.cache import get_generation, bump_generation
+
+UNIT_CONVERSIONS = 'unit_conversions'
+
+_local_matrix = None
+
+
+class ConversionMatrix(object):
+    """
+    Ratios between all pairs of units, None marks units not convertible
+    to each other, e.g. grams and liters.
+    """
+
+    def __init__(self, conversions, unit_ids, generation=None):
+        """
+        :param conversions: (from unit, to unit, ratio) of known conversions
+        :type conversions: iterable
+        :param unit_ids: ids of all units
+        :type unit_ids: iterable
+        """
+        self.generation = generation
+        self._index = dict((unit_id, i) for i, unit_id in enumerate(unit_ids))
+
+        size = len(self._index)
+        ratios = [[None] * size for i in range(size)]
+        for i in range(size):
+            ratios[i][i] = Decimal(1)
+
+        for from_unit, to_unit, ratio in conversions:
+            if from_unit not in self._index or to_unit not in self._index or not ratio:
+                continue
+            i, j = self._index[from_unit], self._index[to_unit]
+            ratios[i][j] = Decimal(ratio)
+            if ratios[j][i] is None:
+                ratios[j][i] = 1 / Decimal(ratio)
+
+        # Floyd-Warshall, direct conversions are kept over derived ones
+        for k in range(size):
+            through = ratios[k]
+            for row in ratios:
+                if row[k] is None:
+                    continue
+                for j in range(size):
+                    if row[j] is None and through[j] is not None:
+                        row[j] = row[k] * through[j]
+        self._ratios = ratios
+
+    def ratio(self, from_unit, to_unit):
+        """
+        :return: number of `to_unit` units in one `from_unit` unit, None if not convertible
+        :rtype: Decimal
+        """
+        i, j = self._index.get(from_unit), self._index.get(to_unit)
+        if i is None or j is None:
+            return None
+        return self._ratios[i][j]
+
+    def convertible(self, from_unit, to_unit):
+        return self.ratio(from_unit, to_unit) is not None
+
+    def convert(self, amounts, to_unit):
+        """
+        Convert many amounts to single unit by one pass over column of
+        ratios to the unit.
+
+        :param amounts: (amount, unit) pairs
+        :type amounts: iterable
+        :param to_unit: id of target unit
+        :type to_unit: int
+        :return: converted amounts in order of given ones, None for amounts \
+            missing or not convertible
+        :rtype: list
+        """
+        j = self._index.get(to_unit)
+        if j is None:
+            return [None for one in amounts]
+
+        column = dict((unit_id, self._ratios[i][j]) for unit_id, i in self._index.items())
+        converted = []
+        for amount, unit in amounts:
+            ratio = column.get(unit)
+            converted.append(amount * ratio if amount is not None and ratio is not None else None)
+        return converted
+
+
+def _matrix_cache_key(generation):
+    return '%s:%s:%s' % (conf.CACHE_PREFIX, UNIT_CONVERSIONS, generation)
+
+
+def get_conversion_matrix():
+    """
+    Conversion matrix of current generation, built only once per change
+    of any unit conversion.
+
+    :rtype: ConversionMatrix
+    """
+    global _local_matrix
+
+    generation = get_generation(UNIT_CONVERSIONS)
+    matrix = _local_matrix
+    if matrix is None or matrix.generation != generation:
+        key = _matrix_cache_key(generation)
+        matrix = cache.get(key)
+        if matrix is None:
+            conversions = get_model('yummy', 'unitconversion').objects.values_list('from_unit', 'to_unit', 'ratio')
+            matrix = ConversionMatrix(conversions, [unit[0] for unit in conf.UNITS], generation)
+            cache.set(key, matrix, conf.CACHE_TIMEOUT_LONG)
+        _local_matrix = matrix
+    return matrix
+
+
+def convert_amounts(amounts, to_unit):
+    """
+    :param amounts: (amount, unit) pairs, e.g. of shopping list items
+    :type amounts: iterable
+    :param to_unit: id of target unit
+    :type to_unit: int
+    :return: converted amounts, None for ones not convertible
+    :rtype: list
+    """
+    return get_conversion_matrix().convert(amounts, to_unit)
+
+
+def invalidate_conversion_matrix():
+    global _local_matrix
+
+    _local_matrix = None
+    bump_generation(UNIT_CONVERSIONS)
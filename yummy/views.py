@@ -1,28 +1,39 @@
+from datetime import date
 from json import dumps
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import reverse
 from django.forms import forms
 from django.http import (
     Http404, HttpResponseRedirect, HttpResponse, HttpResponseNotAllowed,
-    HttpResponseForbidden
+    HttpResponseForbidden, HttpResponseBadRequest, QueryDict
 )
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 from django.template.loader import render_to_string
 from django.views.generic import ListView, DetailView, View, CreateView, UpdateView, DeleteView
 from django.template.defaultfilters import slugify
-from django.utils.translation import ugettext_lazy as _
+from django.utils.cache import patch_vary_headers
+from django.utils.http import urlencode
+from django.utils.translation import get_language, ugettext_lazy as _
 from django.views.generic.detail import SingleObjectTemplateResponseMixin
+from django.views.decorators.http import condition
 
 from yummy.forms import FavoriteRecipeForm, CookBookAddForm, CookBookDeleteForm, CookBookEditForm
 from yummy.models import (
-    Category, Ingredient, Recipe, WeekMenu, IngredientGroup, IngredientInRecipe,
+    Category, Ingredient, Recipe, WeekMenu, IngredientGroup,
     Cuisine, CookBookRecipe, CookBook, ShoppingList
 )
 from yummy import conf
 from yummy.utils import import_module_member
+from yummy.utils.cache import WEEK_MENU, get_generations, hash_key
+from yummy.utils.pagination import (
+    KEYSET_ORDERINGS, LISTING_COUNTS, InvalidCursor, CountedPaginator, ObjectsByIds, get_listing_count,
+    paginate_keyset
+)
+from yummy.utils.tree import CATEGORY_TREE
 
 
 FUNC_QS_BY_RATING = conf.FUNC_QS_BY_RATING
@@ -47,7 +58,175 @@ class JSONResponseMixin(object):
         return dumps(context, ensure_ascii=False)
 
 
-class CynosureList(ListView):
+class ConditionalGetMixin(object):
+    """
+    Answer conditional GET by 304 before view does any work. Validators
+    have to be cheap, e.g. built from cache generations. Used for anonymous
+    requests only, pages of logged users contain user specific parts.
+    """
+
+    def get_etag(self):
+        return None
+
+    def get_last_modified(self):
+        return None
+
+    def dispatch(self, request, *args, **kwargs):
+        dispatch = super(ConditionalGetMixin, self).dispatch
+        # requests without session are anonymous, don't touch the session so response doesn't vary on cookie
+        user = getattr(request, 'user', None)
+        if settings.SESSION_COOKIE_NAME in request.COOKIES and user is not None and user.is_authenticated():
+            return dispatch(request, *args, **kwargs)
+
+        response = condition(
+            etag_func=lambda *args, **kwargs: self.get_etag(),
+            last_modified_func=lambda *args, **kwargs: self.get_last_modified(),
+        )(dispatch)(request, *args, **kwargs)
+
+        # only full pages are validated, errors and redirects must not turn into 304 later
+        if response.status_code not in (200, 304):
+            for header in ('ETag', 'Last-Modified'):
+                if response.has_header(header):
+                    del response[header]
+        return response
+
+
+class ListingConditionalGetMixin(ConditionalGetMixin):
+    """ETag of recipe listing, changed with any change of listed recipes or categories"""
+
+    def get_etag(self):
+        return hash_key([
+            self.__class__.__name__,
+            self.request.get_full_path(),
+            self.get_order_attr(),
+            self.get_photo_attr(),
+        ] + get_generations([LISTING_COUNTS, CATEGORY_TREE]))
+
+
+class RecipeListMixin(object):
+    """Resolve top photos of all listed recipes at once"""
+
+    def get_context_data(self, **kwargs):
+        data = super(RecipeListMixin, self).get_context_data(**kwargs)
+        recipes = Recipe.objects.attach_top_photos(list(data['object_list']))
+        data['object_list'] = recipes
+        context_object_name = self.get_context_object_name(recipes)
+        if context_object_name in data:
+            data[context_object_name] = recipes
+        return data
+
+
+class KeysetPaginationMixin(object):
+    """
+    Paginate by cursor seeking past the last listed item instead of page
+    offset. Used only if enabled and listing is ordered by one of
+    KEYSET_ORDERINGS, other orderings are paginated by page number.
+    """
+
+    def get_keyset_order_attr(self):
+        return None
+
+    def paginate_queryset(self, queryset, page_size):
+        order_attr = self.get_keyset_order_attr()
+        if not conf.LISTING_KEYSET_PAGINATION or order_attr not in KEYSET_ORDERINGS:
+            return super(KeysetPaginationMixin, self).paginate_queryset(queryset, page_size)
+
+        try:
+            page = paginate_keyset(queryset, order_attr, page_size, self.request.GET.get(conf.LISTING_CURSOR_PARAM))
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        return (None, page, page.object_list, page.has_other_pages())
+
+
+class CachedCountMixin(object):
+    """Take count of listed objects from cache shared by all pages of the listing"""
+
+    paginator_class = CountedPaginator
+
+    def get_count_filters(self):
+        return ()
+
+    def allow_estimated_count(self):
+        return False
+
+    def get_count_key(self):
+        cynosure = getattr(self, '_cynosure', None)
+        return (self.__class__.__name__, cynosure.pk if cynosure is not None else '') + tuple(self.get_count_filters())
+
+    def get_paginator(self, queryset, per_page, **kwargs):
+        kwargs['count_func'] = lambda: get_listing_count(queryset, self.get_count_key(), self.allow_estimated_count())
+        return super(CachedCountMixin, self).get_paginator(queryset, per_page, **kwargs)
+
+
+class ListingOrderMixin(object):
+    """
+    Ordering and photo filter of recipe listings. Read from query string
+    if YUMMY_LISTING_URL_ORDERING is set, so listings are cacheable by
+    shared caches, cookies set by CategoryReorder only select the
+    canonical url then. Read from the cookies otherwise.
+    """
+
+    def _get_listing_option(self, param, cookie, options, default, from_cookie=False):
+        if conf.LISTING_URL_ORDERING and not from_cookie:
+            value = self.request.GET.get(param)
+        else:
+            value = self.request.COOKIES.get(cookie)
+        return value if value in options else default
+
+    def get_order_attr(self, from_cookie=False):
+        return self._get_listing_option(conf.CATEGORY_ORDER_PARAM, conf.CATEGORY_ORDER_ATTR,
+                                        conf.CATEGORY_ORDERING, conf.CATEGORY_ORDER_DEFAULT, from_cookie)
+
+    def get_photo_attr(self, from_cookie=False):
+        return self._get_listing_option(conf.CATEGORY_PHOTO_PARAM, conf.CATEGORY_PHOTO_ATTR,
+                                        conf.CATEGORY_PHOTO_OPTIONS, conf.CATEGORY_PHOTO_OPTIONS[0], from_cookie)
+
+    def get_listing_query(self):
+        """query string part to keep ordering in links to other pages of listing"""
+        if not conf.LISTING_URL_ORDERING:
+            return ''
+        return urlencode([
+            (conf.CATEGORY_ORDER_PARAM, self.get_order_attr()),
+            (conf.CATEGORY_PHOTO_PARAM, self.get_photo_attr()),
+        ]) + '&'
+
+    def is_bare_listing_url(self):
+        """
+        :return: True if ordering is read from url but the url has none, \
+            response to such url depends on cookies
+        :rtype: bool
+        """
+        GET = self.request.GET
+        return conf.LISTING_URL_ORDERING and conf.CATEGORY_ORDER_PARAM not in GET and conf.CATEGORY_PHOTO_PARAM not in GET
+
+    def get_canonical_redirect(self):
+        """
+        :return: redirect of request without ordering in url to url with \
+            ordering preferred in cookies, None if there's no need to redirect
+        :rtype: HttpResponseRedirect
+        """
+        if not self.is_bare_listing_url():
+            return None
+
+        order_attr = self.get_order_attr(from_cookie=True)
+        photo_attr = self.get_photo_attr(from_cookie=True)
+        if (order_attr, photo_attr) == (conf.CATEGORY_ORDER_DEFAULT, conf.CATEGORY_PHOTO_OPTIONS[0]):
+            return None
+
+        query = [(key, value) for key, values in self.request.GET.lists() for value in values]
+        query += [(conf.CATEGORY_ORDER_PARAM, order_attr), (conf.CATEGORY_PHOTO_PARAM, photo_attr)]
+        return HttpResponseRedirect('%s?%s' % (self.request.path, urlencode(query)))
+
+    def get_ordering_context(self):
+        return {
+            'current_order_attr': self.get_order_attr(),
+            'current_photo_attr': self.get_photo_attr(),
+            'ranking_attrs': conf.CATEGORY_ORDERING,
+            'listing_query': self.get_listing_query(),
+        }
+
+
+class CynosureList(ListingOrderMixin, ListView):
 
     context_cynosure_name = 'cynosure'
     paginate_by = conf.LISTING_PAGINATE_BY
@@ -68,31 +247,26 @@ class CynosureList(ListView):
 
     def get_context_data(self, **kwargs):
         data = super(CynosureList, self).get_context_data(**kwargs)
-        COOKIES = self.request.COOKIES
-        current_order_attr = COOKIES.get(conf.CATEGORY_ORDER_ATTR)
-        if current_order_attr not in dict(conf.CATEGORY_ORDERING).keys():
-            current_order_attr = conf.CATEGORY_ORDER_DEFAULT
-
-        current_photo_attr = COOKIES.get(conf.CATEGORY_PHOTO_ATTR)
-        if current_photo_attr not in conf.CATEGORY_PHOTO_OPTIONS:
-            current_photo_attr = conf.CATEGORY_PHOTO_OPTIONS[0]
-
-        data.update({
-            'current_order_attr': current_order_attr,
-            'current_photo_attr': current_photo_attr,
-            'ranking_attrs': conf.CATEGORY_ORDERING,
-            self.context_cynosure_name: self.cynosure,
-        })
+        data.update(self.get_ordering_context())
+        data[self.context_cynosure_name] = self.cynosure
         return data
 
 
-class DailyMenu(JSONResponseMixin, View):
+class DailyMenu(ConditionalGetMixin, JSONResponseMixin, View):
+
+    def get_etag(self):
+        return hash_key([date.today()] + get_generations([WEEK_MENU, LISTING_COUNTS]))
 
     def get(self, request, *args, **kwargs):
         if not request.is_ajax():
             return HttpResponseNotAllowed("Allowed AJAX request only")
 
         menu_days = WeekMenu.objects.get_actual()
+        Recipe.objects.attach_top_photos([
+            getattr(day_menu, one) for day_menu in menu_days.values()
+            for one in ('soup', 'meal', 'dessert') if getattr(day_menu, one)
+        ])
+
         menu_data = dict([(one, {}) for one in range(1, 8)])
         for day_index, day_menu in menu_days.items():
             menu_data[day_index] = self.arrange_menu_item(day_menu)
@@ -129,6 +303,10 @@ class IngredientView(ListView):
     def get_context_data(self, **kwargs):
         data = super(IngredientView, self).get_context_data(**kwargs)
 
+        counts = Ingredient.objects.get_recipes_counts([one.pk for one in data['object_list']])
+        for one in data['object_list']:
+            one.recipes_count = counts[one.pk]
+
         data.update({
             'groups': IngredientGroup.objects.all(),
             'months': conf.MONTHS,
@@ -149,53 +327,121 @@ class IngredientGroupView(CynosureList):
         return IngredientGroup.objects.get(slug=self.kwargs['group'])
 
 
-class IngredientDetail(CynosureList):
+class IngredientDetail(RecipeListMixin, CynosureList):
 
     template_name = 'yummy/ingredient/detail.html'
-    model = IngredientInRecipe
+    model = Recipe
 
     def get_queryset(self):
-        return Recipe.objects.filter(ingredientinrecipe__ingredient=self.cynosure).distinct()
+        count, ids = Ingredient.objects.get_recipe_index(self.cynosure.pk)
+        rest = None
+        if count > len(ids):
+            # index keeps only newest recipes, older pages are queried
+            rest = Recipe.objects.public().cards().filter(ingredientinrecipe__ingredient=self.cynosure).\
+                order_by('-pk').distinct()
+        return ObjectsByIds(ids, Recipe.objects.cards(), count, rest)
 
     def get_cynosure(self):
         return Ingredient.objects.get(slug=self.kwargs['ingredient'])
 
+    def get_context_data(self, **kwargs):
+        data = super(IngredientDetail, self).get_context_data(**kwargs)
+        data['alternatives'] = Ingredient.objects.get_alternatives(self.cynosure.pk)
+        return data
 
-class OrderListView(ListView):
+
+class IngredientAutocomplete(JSONResponseMixin, View):
+    """ingredients with name or word of name starting with ``q`` parameter"""
+
+    def get(self, request, *args, **kwargs):
+        found = Ingredient.objects.autocomplete(request.GET.get('q', ''))
+        return self.render_to_response([
+            {
+                'name': name,
+                'link': reverse('yummy:ingredient_detail', args=(slug,)),
+            }
+            for pk, name, slug in found
+        ])
+
+
+class IngredientMatch(JSONResponseMixin, View):
+    """
+    Recipes cookable from ingredients given by ``ingredient`` parameters,
+    optionally limited by ``min_matched`` and ``max_missing`` counts,
+    ``substitutes=1`` counts substituted ingredients as matched.
+    """
+
+    def get(self, request, *args, **kwargs):
+        GET = request.GET
+        try:
+            ingredient_ids = [int(one) for one in GET.getlist('ingredient')]
+            min_matched = int(GET.get('min_matched') or 1)
+            max_missing = int(GET['max_missing']) if GET.get('max_missing') else None
+        except ValueError:
+            return HttpResponseBadRequest("Invalid ingredients or counts")
+
+        matches = Recipe.objects.match_ingredients(ingredient_ids, min_matched, max_missing,
+                                                   substitutes=GET.get('substitutes') == '1',
+                                                   limit=conf.LISTING_PAGINATE_BY)
+        recipes = Recipe.objects.cards().in_bulk([one.recipe_id for one in matches])
+
+        return self.render_to_response([
+            {
+                'title': recipes[one.recipe_id].title,
+                'link': recipes[one.recipe_id].get_absolute_url(),
+                'matched': one.matched,
+                'missing': one.missing,
+            }
+            for one in matches if one.recipe_id in recipes
+        ])
+
+
+class OrderListView(ListingOrderMixin, ListView):
     paginate_by = conf.LISTING_PAGINATE_BY
 
     def get_objects_count(self):
-        return Recipe.objects.public().count()
+        return get_listing_count(Recipe.objects.public(), ('all_recipes',), estimate=True)
 
     def get_context_data(self, **kwargs):
         data = super(OrderListView, self).get_context_data(**kwargs)
-        data.update({
-            'current_order_attr': self.request.COOKIES.get(conf.CATEGORY_ORDER_ATTR) or conf.CATEGORY_ORDER_DEFAULT,
-            'current_photo_attr': self.request.COOKIES.get(conf.CATEGORY_PHOTO_ATTR) or 'all',
-            'ranking_attrs': conf.CATEGORY_ORDERING,
-            'all_recipes_count': self.get_objects_count(),
-        })
+        data.update(self.get_ordering_context())
+        data['all_recipes_count'] = self.get_objects_count()
         return data
 
 
-class CategoryView(OrderListView):
+class CategoryView(ListingConditionalGetMixin, RecipeListMixin, KeysetPaginationMixin, CachedCountMixin, OrderListView):
     template_name = 'yummy/category/index.html'
     model = Recipe
 
     def get_queryset(self):
-        qs = self.model.objects.public()
+        qs = self.model.objects.public().cards()
         qs = self.order_queryset(qs)
         return qs
 
+    def dispatch(self, request, *args, **kwargs):
+        response = self.get_canonical_redirect()
+        if response is None:
+            response = super(CategoryView, self).dispatch(request, *args, **kwargs)
+        # bare url is redirected or not by cookies, shared caches must keep both answers
+        if self.is_bare_listing_url():
+            patch_vary_headers(response, ('Cookie',))
+        return response
+
+    def get_keyset_order_attr(self):
+        return self.get_order_attr()
+
+    def get_count_filters(self):
+        return (self.get_photo_attr(), self.get_order_attr())
+
+    def allow_estimated_count(self):
+        return self.get_photo_attr() == 'all'
+
     def order_queryset(self, qs):
-        photo_attr = self.request.COOKIES.get(conf.CATEGORY_PHOTO_ATTR) or 'all'
+        photo_attr = self.get_photo_attr()
         if photo_attr != 'all':
-            qs = qs.filter(recipephoto__isnull=False).distinct()
-
-        order_attr = self.request.COOKIES.get(conf.CATEGORY_ORDER_ATTR)
-        if order_attr not in conf.CATEGORY_ORDERING.keys():
-            order_attr = conf.CATEGORY_ORDER_DEFAULT
+            qs = qs.filter(has_photo=True)
 
+        order_attr = self.get_order_attr()
         if order_attr == 'by_rating' and FUNC_QS_BY_RATING:
             qs = FUNC_QS_BY_RATING(qs)
         else:
@@ -210,10 +456,12 @@ class CategoryDetail(CynosureList, CategoryView):
     def get_cynosure(self):
         return Category.objects.get(path=self.kwargs['path'])
 
+    def allow_estimated_count(self):
+        return False
+
     def get_queryset(self):
         qs = super(CategoryDetail, self).get_queryset()
-        subcats = [self.cynosure] + self.cynosure.get_descendants()
-        qs = qs.filter(category__in=subcats)
+        qs = qs.in_category(self.cynosure)
         return qs
 
 
@@ -221,34 +469,77 @@ class CategoryReorder(View):
     def get(self, request, *args, **kwargs):
         # TODO - check or sign next_url (see Entree)
         next_url = request.GET.get('next_url') or '/'
-        response = HttpResponseRedirect(next_url)
 
         order_attr = kwargs.get('order_attr')
         if order_attr not in conf.CATEGORY_ORDERING:
             order_attr = conf.CATEGORY_ORDER_DEFAULT
 
-        if request.COOKIES.get(conf.CATEGORY_ORDER_ATTR) != order_attr:
-            response.set_cookie(conf.CATEGORY_ORDER_ATTR, order_attr)
-
         photo_attr = kwargs.get('photo_attr')
         if photo_attr not in conf.CATEGORY_PHOTO_OPTIONS:
             photo_attr = conf.CATEGORY_PHOTO_OPTIONS[0]
+
+        if conf.LISTING_URL_ORDERING:
+            next_url = self.get_ordered_url(next_url, order_attr, photo_attr)
+        response = HttpResponseRedirect(next_url)
+
+        if request.COOKIES.get(conf.CATEGORY_ORDER_ATTR) != order_attr:
+            response.set_cookie(conf.CATEGORY_ORDER_ATTR, order_attr)
         if request.COOKIES.get(conf.CATEGORY_PHOTO_ATTR) != photo_attr:
             response.set_cookie(conf.CATEGORY_PHOTO_ATTR, photo_attr)
 
         return response
 
+    def get_ordered_url(self, url, order_attr, photo_attr):
+        """url with given ordering in query string, position in listing is dropped"""
+        path, _sep, query = url.partition('?')
+        dropped = (conf.LISTING_CURSOR_PARAM, 'page', conf.CATEGORY_ORDER_PARAM, conf.CATEGORY_PHOTO_PARAM)
+        query = [
+            (key, value) for key, values in QueryDict(query).lists() if key not in dropped for value in values
+        ]
+        query += [(conf.CATEGORY_ORDER_PARAM, order_attr), (conf.CATEGORY_PHOTO_PARAM, photo_attr)]
+        return '%s?%s' % (path, urlencode(query))
+
 
-class RecipeDetail(DetailView):
+class RecipeDetail(ConditionalGetMixin, DetailView):
     template_name = 'yummy/recipe/detail.html'
+    fragment_template_name = 'yummy/recipe/detail_content.html'
 
     model = Recipe
 
+    def render_fragment(self, detail):
+        return render_to_string(self.fragment_template_name, detail)
+
+    def get_detail(self):
+        if not hasattr(self, 'detail'):
+            self.detail = self.model.objects.get_detail(self.kwargs.get('recipe_id'), self.render_fragment)
+        return self.detail
+
+    def get_etag(self):
+        # private recipe is refused, nothing to validate; no Last-Modified either,
+        # changes of ingredients or photos don't touch Recipe.updated
+        detail = self.get_detail()
+        if detail is None or not detail['object'].is_public:
+            return None
+        return hash_key([self.request.path, get_language()] +
+                        self.model.objects.get_detail_version(self.kwargs.get('recipe_id')))
+
     def get_object(self, queryset=None):
-        try:
-            return self.model.objects.get(pk=self.kwargs.get('recipe_id'), slug=self.kwargs.get('recipe_slug'))
-        except self.model.DoesNotExist:
+        detail = self.get_detail()
+        if detail is None or detail['object'].slug != self.kwargs.get('recipe_slug'):
             raise Http404("Given recipe not found")
+        return detail['object']
+
+    def get_context_data(self, **kwargs):
+        data = super(RecipeDetail, self).get_context_data(**kwargs)
+        data.update({
+            'photos': self.detail['photos'],
+            'cuisines': self.detail['cuisines'],
+            'recipe_fragment': self.detail['fragment'],
+        })
+        # user specific, kept out of cached detail
+        if self.request.user.is_authenticated():
+            data['cookbook_items'] = CookBook.objects.get_user_cookbook_items_for_recipe(self.request.user, self.object)
+        return data
 
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
@@ -261,7 +552,7 @@ class RecipeDetail(DetailView):
         return super(RecipeDetail, self).get(request, *args, **kwargs)
 
 
-class AuthorRecipes(CynosureList):
+class AuthorRecipes(ListingConditionalGetMixin, RecipeListMixin, CachedCountMixin, CynosureList):
 
     template_name = 'yummy/recipe/author.html'
     model = Recipe
@@ -270,10 +561,10 @@ class AuthorRecipes(CynosureList):
         return User.objects.get(pk=self.kwargs['author_id'])
 
     def get_queryset(self):
-        return self.model.objects.public().filter(owner=self.cynosure)
+        return self.model.objects.public().cards().filter(owner=self.cynosure)
 
 
-class CuisineView(CynosureList):
+class CuisineView(ListingConditionalGetMixin, RecipeListMixin, CachedCountMixin, CynosureList):
 
     model = Recipe
     template_name = 'yummy/recipe/cuisine.html'
@@ -282,7 +573,7 @@ class CuisineView(CynosureList):
         return Cuisine.objects.get(slug=self.kwargs['slug'])
 
     def get_queryset(self):
-        return Recipe.objects.public().filter(cuisines=self.cynosure)
+        return Recipe.objects.public().cards().filter(cuisines=self.cynosure)
 
 
 class AuthorList(OrderListView):
@@ -355,9 +646,9 @@ class CookBookDetail(CynosureList):
 
     def get_queryset(self):
         if self.cynosure.owner != self.request.user:
-            qs = Recipe.objects.public().filter(cookbook=self.cynosure)
+            qs = Recipe.objects.public().cards().filter(cookbook=self.cynosure)
         else:
-            qs = Recipe.objects.filter(cookbook=self.cynosure)
+            qs = Recipe.objects.cards().filter(cookbook=self.cynosure)
         qs = qs.order_by('-created')
         return qs
 
@@ -372,6 +663,11 @@ class CookBookPrint(CynosureList):
     def get_queryset(self):
         return Recipe.objects.filter(cookbookrecipe__cookbook=self.cynosure)
 
+    def get_context_data(self, **kwargs):
+        data = super(CookBookPrint, self).get_context_data(**kwargs)
+        data['object_list'] = Recipe.objects.attach_groupped_ingredients(list(data['object_list']))
+        return data
+
 
 class CookBookMixin(SingleObjectTemplateResponseMixin):
     template_name = 'yummy/cookbook/new.html'